@@ -0,0 +1,213 @@
+import math
+from collections import defaultdict
+from sqlalchemy import event, update, insert, delete, select, bindparam
+from extensions import db
+from models import Landmark, LandmarkCluster
+
+MAX_CLUSTER_ZOOM = 16
+
+# every 256px map tile is split into 4x4 cells, so a cluster covers roughly 64x64 screen pixels
+CELLS_PER_TILE = 4
+MAX_MERCATOR_LAT = 85.05112878
+
+# a 4k screen is about 60x34 cells, anything much bigger is not a viewport
+MAX_VIEWPORT_CELLS = 4096
+
+
+########################################################################## web mercator grid cell (x, y) of a coordinate at a zoom level
+def cell_for(lat, lon, zoom):
+    cells = (2 ** zoom) * CELLS_PER_TILE
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    sin_lat = math.sin(math.radians(lat))
+
+    x = (lon + 180.0) / 360.0
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return (
+        min(cells - 1, max(0, int(x * cells))),
+        min(cells - 1, max(0, int(y * cells)))
+    )
+
+
+
+########################################################################## bounding box (min_lat, min_lon, max_lat, max_lon) of every coordinate cell_for puts in a grid cell
+def cell_bounds(cell_x, cell_y, zoom):
+    cells = (2 ** zoom) * CELLS_PER_TILE
+
+    def lat_at(y):
+        # cell_for clamps latitudes past MAX_MERCATOR_LAT into the top and bottom rows, their boxes reach the poles
+        if y <= 0:
+            return 90.0
+        if y >= cells:
+            return -90.0
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / cells))))
+
+    return (
+        lat_at(cell_y + 1), cell_x / cells * 360.0 - 180.0,
+        lat_at(cell_y), (cell_x + 1) / cells * 360.0 - 180.0
+    )
+
+
+
+########################################################################## adds (or with sign=-1 removes) one landmark to every zoom level
+def update_clusters(connection, landmark_id, lat, lon, sign):
+    lat, lon = float(lat), float(lon)
+
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        cell_x, cell_y = cell_for(lat, lon, zoom)
+        key = (
+            (LandmarkCluster.zoom == zoom) &
+            (LandmarkCluster.cell_x == cell_x) &
+            (LandmarkCluster.cell_y == cell_y)
+        )
+
+        result = connection.execute(update(LandmarkCluster).where(key).values(
+            count=LandmarkCluster.count + sign,
+            sum_lat=LandmarkCluster.sum_lat + sign * lat,
+            sum_lon=LandmarkCluster.sum_lon + sign * lon
+        ))
+
+        if sign > 0:
+            if result.rowcount == 0:
+                connection.execute(insert(LandmarkCluster).values(
+                    zoom=zoom, cell_x=cell_x, cell_y=cell_y,
+                    count=1, sum_lat=lat, sum_lon=lon, representative_id=landmark_id
+                ))
+            continue
+
+        connection.execute(delete(LandmarkCluster).where(key & (LandmarkCluster.count <= 0)))
+
+        # the removed landmark may have been the one the cluster points at
+        min_lat, min_lon, max_lat, max_lon = cell_bounds(cell_x, cell_y, zoom)
+        replacement = select(Landmark.id).where(
+            Landmark.latitude.between(min_lat, max_lat),
+            Landmark.longitude.between(min_lon, max_lon),
+            Landmark.id != landmark_id
+        ).limit(1).scalar_subquery()
+        connection.execute(update(LandmarkCluster).where(
+            key & (LandmarkCluster.representative_id == landmark_id)
+        ).values(representative_id=replacement))
+
+
+
+########################################################################## removes many (id, lat, lon) landmarks at once, after their rows were bulk deleted
+def remove_from_clusters(connection, landmarks):
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    removed = set()
+    for landmark_id, lat, lon in landmarks:
+        removed.add(landmark_id)
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            delta = deltas[(zoom, *cell_for(lat, lon, zoom))]
+            delta[0] += 1
+            delta[1] += lat
+            delta[2] += lon
+    if not deltas:
+        return
+
+    key = (
+        (LandmarkCluster.zoom == bindparam("b_zoom")) &
+        (LandmarkCluster.cell_x == bindparam("b_cell_x")) &
+        (LandmarkCluster.cell_y == bindparam("b_cell_y"))
+    )
+    cells = [{"b_zoom": zoom, "b_cell_x": cell_x, "b_cell_y": cell_y} for zoom, cell_x, cell_y in deltas]
+    connection.execute(update(LandmarkCluster).where(key).values(
+        count=LandmarkCluster.count - bindparam("b_count"),
+        sum_lat=LandmarkCluster.sum_lat - bindparam("b_sum_lat"),
+        sum_lon=LandmarkCluster.sum_lon - bindparam("b_sum_lon")
+    ), [
+        {**cell, "b_count": count, "b_sum_lat": sum_lat, "b_sum_lon": sum_lon}
+        for cell, (count, sum_lat, sum_lon) in zip(cells, deltas.values())
+    ])
+    connection.execute(delete(LandmarkCluster).where(key & (LandmarkCluster.count <= 0)), cells)
+
+    # the landmark rows are gone already, any landmark still inside the cell can stand in
+    stale = connection.execute(select(LandmarkCluster.zoom, LandmarkCluster.cell_x, LandmarkCluster.cell_y).where(
+        LandmarkCluster.representative_id.in_(removed)
+    )).all()
+    if stale:
+        replacement = select(Landmark.id).where(
+            Landmark.latitude.between(bindparam("b_min_lat"), bindparam("b_max_lat")),
+            Landmark.longitude.between(bindparam("b_min_lon"), bindparam("b_max_lon"))
+        ).limit(1).scalar_subquery()
+        params = []
+        for zoom, cell_x, cell_y in stale:
+            min_lat, min_lon, max_lat, max_lon = cell_bounds(cell_x, cell_y, zoom)
+            params.append({
+                "b_zoom": zoom, "b_cell_x": cell_x, "b_cell_y": cell_y,
+                "b_min_lat": min_lat, "b_max_lat": max_lat, "b_min_lon": min_lon, "b_max_lon": max_lon
+            })
+        connection.execute(update(LandmarkCluster).where(key).values(representative_id=replacement), params)
+
+
+
+########################################################################## clusters of one zoom level inside a bounding box
+def clusters_in_bbox(min_lat, min_lon, max_lat, max_lon, zoom):
+    cells = (2 ** zoom) * CELLS_PER_TILE
+    min_x, min_y = cell_for(max_lat, min_lon, zoom)
+    max_x, max_y = cell_for(min_lat, max_lon, zoom)
+
+    # boxes crossing the antimeridian wrap around the end of the grid
+    x_ranges = [(min_x, max_x)] if min_lon <= max_lon else [(min_x, cells - 1), (0, max_x)]
+
+    cell_count = sum(high - low + 1 for low, high in x_ranges) * (max_y - min_y + 1)
+    if cell_count > MAX_VIEWPORT_CELLS:
+        raise ValueError("Viewport is too large for this zoom level")
+
+    x_filter = db.or_(*[LandmarkCluster.cell_x.between(low, high) for low, high in x_ranges])
+    return LandmarkCluster.query.filter(
+        LandmarkCluster.zoom == zoom,
+        x_filter,
+        LandmarkCluster.cell_y.between(min_y, max_y)
+    ).all()
+
+
+
+########################################################################## recomputes the whole cluster hierarchy from the landmark table
+def rebuild_clusters():
+    clusters = defaultdict(lambda: [0, 0.0, 0.0, None])
+    rows = db.session.query(Landmark.id, Landmark.latitude, Landmark.longitude).yield_per(1000)
+
+    for landmark_id, lat, lon in rows:
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            cluster = clusters[(zoom, *cell_for(lat, lon, zoom))]
+            cluster[0] += 1
+            cluster[1] += lat
+            cluster[2] += lon
+            if cluster[3] is None:
+                cluster[3] = landmark_id
+
+    db.session.execute(delete(LandmarkCluster))
+    if clusters:
+        db.session.execute(insert(LandmarkCluster), [
+            {
+                "zoom": zoom, "cell_x": cell_x, "cell_y": cell_y,
+                "count": count, "sum_lat": sum_lat, "sum_lon": sum_lon, "representative_id": representative_id
+            }
+            for (zoom, cell_x, cell_y), (count, sum_lat, sum_lon, representative_id) in clusters.items()
+        ])
+    db.session.commit()
+    return len(clusters)
+
+
+
+########################################################################## keeps the cluster hierarchy in sync with landmark writes
+def add_landmark_to_clusters(mapper, connection, target):
+    update_clusters(connection, target.id, target.latitude, target.longitude, 1)
+
+def remove_landmark_from_clusters(mapper, connection, target):
+    update_clusters(connection, target.id, target.latitude, target.longitude, -1)
+
+def move_landmark_in_clusters(mapper, connection, target):
+    state = db.inspect(target)
+    lat_hist = state.attrs.latitude.history
+    lon_hist = state.attrs.longitude.history
+    if not lat_hist.has_changes() and not lon_hist.has_changes():
+        return
+
+    old_lat = lat_hist.deleted[0] if lat_hist.deleted else target.latitude
+    old_lon = lon_hist.deleted[0] if lon_hist.deleted else target.longitude
+    update_clusters(connection, target.id, old_lat, old_lon, -1)
+    update_clusters(connection, target.id, target.latitude, target.longitude, 1)
+
+event.listen(Landmark, 'after_insert', add_landmark_to_clusters)
+event.listen(Landmark, 'after_delete', remove_landmark_from_clusters)
+event.listen(Landmark, 'after_update', move_landmark_in_clusters)
@@ -0,0 +1,217 @@
+from flask import current_app
+from flask.cli import AppGroup
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Image, ImageVariant, Landmark, Comment
+from jsonprovider import orjson
+from clustering import rebuild_clusters
+from search import search, rebuild_search_index
+from ranking import rebuild_scores
+from counters import reconcile_counters
+from serializers import landmark_serializer
+from passwords import hash_password_sync, verify_password_sync
+from routes.landmarkRoutes import DEFAULT_PAGE_SIZE
+import jobs
+import click
+import datetime
+import random
+import threading
+import time
+import tracemalloc
+
+# maintenance and benchmark commands, grouped as flask landmarks|auth|jobs <command>
+landmarks_cli = AppGroup("landmarks")
+auth_cli = AppGroup("auth")
+jobs_cli = AppGroup("jobs")
+
+
+def init_app(app):
+    for group in (landmarks_cli, auth_cli, jobs_cli):
+        app.cli.add_command(group)
+
+
+
+########################################################################## rebuilds landmark clusters from scratch (flask landmarks rebuild-clusters)
+@landmarks_cli.command("rebuild-clusters")
+def rebuild_clusters_command():
+    print(f"Rebuilt {rebuild_clusters()} clusters")
+
+
+
+########################################################################## recounts likes/dislikes from the reaction table (flask landmarks reconcile-counters)
+@landmarks_cli.command("reconcile-counters")
+def reconcile_counters_command():
+    print(f"Corrected {reconcile_counters()} landmarks")
+
+
+
+########################################################################## refills the search index from the tables (flask landmarks rebuild-search)
+@landmarks_cli.command("rebuild-search")
+def rebuild_search_command():
+    with db.engine.begin() as connection:
+        print(f"Indexed {rebuild_search_index(connection)} documents")
+
+
+
+########################################################################## recomputes the top and trending scores (flask landmarks rebuild-scores)
+@landmarks_cli.command("rebuild-scores")
+def rebuild_scores_command():
+    with db.engine.begin() as connection:
+        print(f"Scored {rebuild_scores(connection)} landmarks")
+
+
+
+########################################################################## search latency over a scratch index (flask landmarks bench-search)
+@landmarks_cli.command("bench-search")
+@click.option("--count", default=100000, help="Documents in the scratch index, a third of them landmarks.")
+@click.option("--queries", default=200, help="Queries per kind.")
+def bench_search_command(count, queries):
+    rng = random.Random(1)
+    # a made up vocabulary with zipf distributed word frequencies, like real text
+    vocabulary = list(dict.fromkeys("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10))) for _ in range(5000)))
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    def sentence(length):
+        return " ".join(rng.choices(vocabulary, weights, k=length))
+
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    landmarks = count // 3
+    with engine.begin() as connection:
+        connection.execute(insert(Image), [{"hash": "0" * 64, "data": b"", "mime_type": "image/webp", "size": 0}])
+        connection.execute(insert(Landmark), [{
+            "id": i + 1, "name": sentence(3), "description": sentence(30), "image_hash": "0" * 64,
+            "latitude": 0, "longitude": 0, "user_id": 1
+        } for i in range(landmarks)])
+        connection.execute(insert(Comment), [{
+            "id": i + 1, "text": sentence(15), "landmark_id": rng.randrange(landmarks) + 1, "user_id": 1,
+            "date_of_creation": datetime.datetime(2024, 1, 1)
+        } for i in range(count - landmarks)])
+        print(f"Indexed {rebuild_search_index(connection)} documents")
+
+    kinds = {
+        "common word": lambda: rng.choice(vocabulary[:10]),
+        "two words": lambda: f"{rng.choice(vocabulary[:100])} {rng.choice(vocabulary[:100])}",
+        "rare word": lambda: rng.choice(vocabulary[2000:]),
+        "prefix of 3": lambda: rng.choice(vocabulary[:100])[:3],
+        "prefix of 5": lambda: rng.choice(vocabulary[:100])[:5],
+    }
+    print(f"{'query':<16} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    with engine.connect() as connection:
+        for name, make in kinds.items():
+            timings = []
+            for _ in range(queries):
+                started = time.perf_counter()
+                search(make(), DEFAULT_PAGE_SIZE, 0, prefix=name.startswith("prefix"), connection=connection)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            print(f"{name:<16} {timings[len(timings) // 2]:>8.2f} {timings[int(len(timings) * 0.95)]:>8.2f} {timings[-1]:>8.2f}")
+    engine.dispose()
+
+
+
+########################################################################## /landmarks payload build and encode, ORM + stdlib json vs Core rows + app.json (flask landmarks bench-serialization)
+@landmarks_cli.command("bench-serialization")
+@click.option("--count", default=10000, help="Landmarks in the scratch database.")
+@click.option("--repeat", default=5, help="Runs per path, the best one is reported.")
+def bench_serialization_command(count, repeat):
+    # a scratch in-memory database, the app's own data is never touched
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Image), [
+            {"hash": f"{i:064x}", "data": b"", "mime_type": "image/webp", "size": 0} for i in range(count + 1)
+        ])
+        connection.execute(insert(Landmark), [{
+            "id": i + 1, "name": f"Landmark {i}", "description": "A landmark worth a visit. " * 4,
+            "image_hash": f"{i:064x}", "likes": i % 97, "dislikes": i % 13, "comment_count": i % 7,
+            "latitude": 48 + i / count, "longitude": 17 + i / count, "user_id": 1
+        } for i in range(count)])
+        # half of the landmarks already have their variants rendered
+        connection.execute(insert(ImageVariant), [
+            {"source_hash": f"{i:064x}", "variant": variant, "image_hash": f"{count:064x}"}
+            for i in range(0, count, 2) for variant in ("thumb", "card", "full")
+        ])
+
+    stdlib = DefaultJSONProvider(current_app._get_current_object())
+
+    def orm_path(session):
+        landmarks = session.query(Landmark).order_by(Landmark.id).all()
+        return {"landmarks": [landmark.to_json() for landmark in landmarks], "next_cursor": None}, encode_stdlib
+
+    def encode_stdlib(payload):
+        # what jsonify produced before, compact like in production
+        return stdlib.dumps(payload, separators=(",", ":")).encode()
+
+    def rows_path(session):
+        stmt, serialize = landmark_serializer(session=session)
+        rows = session.execute(stmt.order_by(Landmark.id)).all()
+        return {"landmarks": serialize(rows), "next_cursor": None}, current_app.json.dumpb
+
+    print(f"{count} landmarks, best of {repeat}, encoder {type(current_app.json).__name__} ({'orjson' if orjson else 'stdlib'})")
+    print(f"{'path':<14} {'build ms':>10} {'encode ms':>10} {'total ms':>10} {'peak MB':>9} {'bytes':>10}")
+    with current_app.test_request_context():
+        for name, path in (("orm + stdlib", orm_path), ("rows + fast", rows_path)):
+            build = encode = float("inf")
+            for _ in range(repeat):
+                with Session(engine) as session:
+                    started = time.perf_counter()
+                    payload, dumps = path(session)
+                    built = time.perf_counter()
+                    body = dumps(payload)
+                    build = min(build, built - started)
+                    encode = min(encode, time.perf_counter() - built)
+
+            # a separate run, tracemalloc slows everything down too much to time it
+            with Session(engine) as session:
+                tracemalloc.start()
+                payload, dumps = path(session)
+                dumps(payload)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            print(f"{name:<14} {build * 1000:>10.1f} {encode * 1000:>10.1f} {(build + encode) * 1000:>10.1f} {peak / 2 ** 20:>9.1f} {len(body):>10}")
+    engine.dispose()
+
+
+
+########################################################################## logins/sec per core at several scrypt costs (flask auth bench-passwords)
+@auth_cli.command("bench-passwords")
+@click.option("--seconds", default=2.0, help="How long to measure each cost setting.")
+def bench_passwords_command(seconds):
+    r, p = current_app.config["PASSWORD_SCRYPT_R"], current_app.config["PASSWORD_SCRYPT_P"]
+    print(f"{'n':>8} {'r':>3} {'p':>3} {'ms/login':>10} {'logins/s/core':>14}")
+
+    for n in (2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16):
+        stored = hash_password_sync("benchmark-password", n, r, p)
+        logins = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            verify_password_sync("benchmark-password", stored)
+            logins += 1
+        elapsed = time.perf_counter() - started
+
+        current = " (configured)" if n == current_app.config["PASSWORD_SCRYPT_N"] else ""
+        print(f"{n:>8} {r:>3} {p:>3} {elapsed / logins * 1000:>10.2f} {logins / elapsed:>14.1f}{current}")
+
+
+
+########################################################################## runs job workers in the foreground (flask jobs work), e.g. to drain the queue with JOB_WORKERS=0
+@jobs_cli.command("work")
+@click.option("--workers", default=2, help="Worker threads.")
+def work_command(workers):
+    app = current_app._get_current_object()
+    threads = [
+        threading.Thread(target=jobs.work, args=(app, jobs.worker_name()), name=f"job-worker-{index}", daemon=True)
+        for index in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"{workers} job workers running, Ctrl+C stops them")
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,78 @@
+import hashlib
+import jwt
+from functools import wraps
+from flask import request, make_response, g
+from extensions import db
+from decorators import decode_token
+from models import ResourceVersion
+
+# views that show the caller's own reactions list this, it stands for the caller's "reactions:<user_id>" version
+USER_REACTIONS = "reactions"
+
+
+########################################################################## current version counters of the given resources
+def resource_versions(resources):
+    # read once per request, the etag and the response cache key both need them
+    versions = g.setdefault("resource_versions", {})
+    missing = [name for name in resources if name not in versions]
+    if missing:
+        rows = dict(db.session.query(ResourceVersion.name, ResourceVersion.version).filter(
+            ResourceVersion.name.in_(missing)
+        ).all())
+        versions.update({name: rows.get(name, 0) for name in missing})
+    return [versions[name] for name in resources]
+
+
+
+########################################################################## etag for the current request given the resource versions it depends on
+def compute_etag(resources, args):
+    token = request.cookies.get("access_token") or ""
+    parts = [
+        request.full_path,
+        # /interacted takes its landmark id from a GET body
+        request.get_data(as_text=True),
+        # the same url answers json or ndjson depending on Accept, see streaming.stream_format
+        request.accept_mimetypes.best or "",
+        ",".join(f"{name}:{version}" for name, version in zip(resources, resource_versions(resources))),
+        ",".join(map(str, args)),
+        token,
+    ]
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+
+########################################################################## answers If-None-Match with 304 until one of the resources changes
+def conditional(*resources):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # a stale or forged token must reach the view so it can answer 401
+            token = request.cookies.get("access_token")
+            claims = None
+            if token:
+                try:
+                    claims = decode_token(token)
+                except jwt.InvalidTokenError:
+                    return f(*args, **kwargs)
+
+            # a vote changes nothing the other users see until the counters flush, only the voter's own version moves
+            names = [name for name in resources if name != USER_REACTIONS]
+            if USER_REACTIONS in resources and claims is not None:
+                names.append(f"reactions:{claims['user_id']}")
+            etag = compute_etag(names, args)
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            # responses depend on who is logged in and must be revalidated every time
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            response.vary.add("Accept")
+            return response
+        return decorated
+    return decorator
@@ -4,28 +4,100 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 from extensions import db, migrate
+import counters
+import database
+import jobs
+import metrics
+from jsonprovider import FastJSONProvider
+import passwords
+import responsecache
 
 load_dotenv()
 
 app = Flask(__name__)
+# orjson when installed, flask's stdlib encoder otherwise
+app.json = FastJSONProvider(app)
 CORS(app, supports_credentials=True, origins=["https://damian-zelinka.github.io"])
 
 app.secret_key = os.getenv("SECRET_KEY")
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///semestral.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///semestral.db")
+# comma separated, GET views marked @read_replica read from these instead of the primary
+app.config["SQLALCHEMY_REPLICA_URIS"] = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if uri.strip()]
+app.config["REPLICA_STICKY_SECONDS"] = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# pragmas and pool sizes come from a profile (development, production or test), see database.py
+app.config["DB_PROFILE"] = os.getenv("DB_PROFILE", "development")
+database.configure(app)
+
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
 
+# image variants, image pruning, user deletion, counter reconciliation and cache warming run as jobs
+# from the job table, see jobs.py. JOB_WORKERS=0 runs them before the response of the request that queued them
+app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", 2))
+app.config["JOB_POLL_INTERVAL"] = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+app.config["JOB_LEASE_SECONDS"] = int(os.getenv("JOB_LEASE_SECONDS", 300))
+app.config["JOB_MAX_ATTEMPTS"] = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+app.config["JOB_BACKOFF_BASE"] = float(os.getenv("JOB_BACKOFF_BASE", 2.0))
+app.config["JOB_BACKOFF_MAX"] = float(os.getenv("JOB_BACKOFF_MAX", 600))
+app.config["JOB_RETENTION_DAYS"] = int(os.getenv("JOB_RETENTION_DAYS", 7))
+
+# reaction counters are folded into landmarks in batches, see counters.py
+app.config["COUNTER_FLUSH_INTERVAL"] = float(os.getenv("COUNTER_FLUSH_INTERVAL", 2.0))
+app.config["COUNTER_RECONCILE_INTERVAL"] = float(os.getenv("COUNTER_RECONCILE_INTERVAL", 3600))
+
+# scrypt cost for password hashes, logins rehash automatically when these change
+app.config["PASSWORD_SCRYPT_N"] = int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+app.config["PASSWORD_SCRYPT_R"] = int(os.getenv("PASSWORD_SCRYPT_R", 8))
+app.config["PASSWORD_SCRYPT_P"] = int(os.getenv("PASSWORD_SCRYPT_P", 1))
+app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+# pre-encoded /landmarks pages, RESPONSE_CACHE_BACKEND ("module:Class") swaps the in-process LRU for a shared store
+app.config["RESPONSE_CACHE_SIZE"] = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+app.config["RESPONSE_CACHE_TTL"] = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+app.config["RESPONSE_CACHE_BACKEND"] = os.getenv("RESPONSE_CACHE_BACKEND") or None
+# comma separated, requested again by a job after a write emptied the cache
+app.config["RESPONSE_CACHE_WARM_PATHS"] = [path.strip() for path in os.getenv("RESPONSE_CACHE_WARM_PATHS", "/landmarks").split(",") if path.strip()]
+app.config["RESPONSE_CACHE_WARM_DELAY"] = float(os.getenv("RESPONSE_CACHE_WARM_DELAY", 1.0))
+
+# rows per server side cursor fetch when a list endpoint streams (?stream=json or ?stream=ndjson)
+app.config["STREAM_CHUNK_SIZE"] = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+
+# request latency, SQL and serialization metrics on GET /metrics, see metrics.py. With several worker
+# processes METRICS_DIR must be a directory they all share, otherwise every scrape sees a single worker
+app.config["METRICS_SLOW_REQUEST_SECONDS"] = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", 1.0))
+app.config["METRICS_SLOW_SQL_STATEMENTS"] = int(os.getenv("METRICS_SLOW_SQL_STATEMENTS", 10))
+app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN") or None
+app.config["METRICS_PUBLIC"] = os.getenv("METRICS_PUBLIC", "0") == "1"
+app.config["METRICS_DIR"] = os.getenv("METRICS_DIR") or None
+app.config["METRICS_WRITE_INTERVAL"] = float(os.getenv("METRICS_WRITE_INTERVAL", 5.0))
+
+# first, its hooks wrap everything the other extensions do per request
+metrics.init_app(app)
 db.init_app(app)
+database.init_app(app, db)
 migrate.init_app(app, db)
+counters.init_app(app)
+jobs.init_app(app)
+passwords.init_app(app)
+responsecache.init_app(app)
 
 from routes.authRegRoutes import auth_bp
 from routes.landmarkRoutes import landmarks_bp
 from routes.adminRoutes import admin_bp
 from routes.randomRoutes import random_bp
+from routes.imageRoutes import images_bp
+from routes.jobRoutes import jobs_bp
+from routes.metricsRoutes import metrics_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(landmarks_bp)
 app.register_blueprint(admin_bp)
-app.register_blueprint(random_bp)
\ No newline at end of file
+app.register_blueprint(random_bp)
+app.register_blueprint(images_bp)
+app.register_blueprint(jobs_bp)
+app.register_blueprint(metrics_bp)
+
+import commands
+commands.init_app(app)
\ No newline at end of file
@@ -0,0 +1,239 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import event, update, select, func, bindparam
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Landmark, Reaction, Comment, bump_resource_versions
+from ranking import update_scores, refresh_top_scores
+import jobs
+
+logger = logging.getLogger(__name__)
+
+# landmark id -> [likes delta, dislikes delta, new reactions, new comments], committed but not yet
+# folded into the landmark row and its scores
+_pending = defaultdict(lambda: [0, 0, 0, 0])
+# landmark id -> landmark.counter_generation the pending likes/dislikes deltas were committed under.
+# A reconcile or recount bumps the generation of every landmark it recounts, deltas of an older one
+# are part of that count already and are dropped, whichever process holds them
+_generations = {}
+_lock = threading.Lock()
+
+_app = None
+_flusher = None
+_flusher_pid = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+    app.config.setdefault("COUNTER_FLUSH_INTERVAL", 2.0)
+    app.config.setdefault("COUNTER_RECONCILE_INTERVAL", 3600.0)
+    atexit.register(_flush_at_exit)
+
+
+
+########################################################################## moves a committed transaction's deltas into the shared accumulator
+def merge_committed_deltas(session):
+    deltas = session.info.pop("reaction_deltas", None)
+    activity = session.info.pop("landmark_activity", None)
+    generations = session.info.pop("counter_generations", None) or {}
+    if not deltas and not activity:
+        return
+
+    with _lock:
+        for landmark_id, (likes, dislikes) in (deltas or {}).items():
+            _add_votes(landmark_id, likes, dislikes, generations.get(landmark_id, 0))
+        for landmark_id, (reactions, comments) in (activity or {}).items():
+            pending = _pending[landmark_id]
+            pending[2] += reactions
+            pending[3] += comments
+    _ensure_flusher()
+
+def discard_deltas(session):
+    session.info.pop("reaction_deltas", None)
+    session.info.pop("landmark_activity", None)
+    session.info.pop("counter_generations", None)
+
+
+# callers hold _lock
+def _add_votes(landmark_id, likes, dislikes, generation):
+    pending = _pending[landmark_id]
+    known = _generations.get(landmark_id)
+    if known is not None and generation < known:
+        # committed before a recount whose generation newer deltas already carry
+        return
+    if known is not None and generation > known:
+        pending[0] = pending[1] = 0
+    _generations[landmark_id] = generation
+    pending[0] += likes
+    pending[1] += dislikes
+
+event.listen(Session, 'after_commit', merge_committed_deltas)
+event.listen(Session, 'after_rollback', discard_deltas)
+
+
+
+########################################################################## folds every pending delta into landmark.likes/dislikes and the landmark scores in one transaction
+def flush_counters():
+    with _lock:
+        batch = {landmark_id: tuple(delta) for landmark_id, delta in _pending.items() if any(delta)}
+        generations = dict(_generations)
+        _pending.clear()
+        _generations.clear()
+    if not batch:
+        return 0
+
+    # deltas from before the landmark's last recount match no row, that recount counted them already
+    stmt = update(Landmark).where(
+        Landmark.id == bindparam("landmark_id"),
+        Landmark.counter_generation == bindparam("generation")
+    ).values(
+        likes=Landmark.likes + bindparam("likes_delta"),
+        dislikes=Landmark.dislikes + bindparam("dislikes_delta")
+    )
+    counter_params = [
+        {"landmark_id": landmark_id, "generation": generations.get(landmark_id, 0), "likes_delta": likes, "dislikes_delta": dislikes}
+        for landmark_id, (likes, dislikes, _, _) in batch.items() if likes or dislikes
+    ]
+    try:
+        with db.engine.begin() as connection:
+            if counter_params:
+                connection.execute(stmt, counter_params)
+            update_scores(connection, list(batch), {
+                landmark_id: (reactions, comments) for landmark_id, (_, _, reactions, comments) in batch.items()
+            })
+            bump_resource_versions(connection, {"landmarks"})
+    except Exception:
+        # put the batch back so the next flush retries it
+        with _lock:
+            for landmark_id, (likes, dislikes, reactions, comments) in batch.items():
+                _add_votes(landmark_id, likes, dislikes, generations.get(landmark_id, 0))
+                pending = _pending[landmark_id]
+                pending[2] += reactions
+                pending[3] += comments
+        raise
+
+    return len(batch)
+
+
+
+# likes or dislikes of the landmark the outer statement is updating
+def reaction_count(value):
+    return select(func.count(Reaction.reaction_id)).where(
+        Reaction.landmark_id == Landmark.id,
+        Reaction.value == value
+    ).scalar_subquery()
+
+
+
+########################################################################## recomputes likes/dislikes of every landmark from the reaction table (and the scores if any was off)
+def reconcile_counters():
+    flush_counters()
+
+    with db.engine.begin() as connection:
+        # committed deltas other processes still hold for these landmarks are dropped by the new generation
+        result = connection.execute(update(Landmark).where(
+            (Landmark.likes != reaction_count('like')) | (Landmark.dislikes != reaction_count('dislike'))
+        ).values(
+            likes=reaction_count('like'),
+            dislikes=reaction_count('dislike'),
+            counter_generation=Landmark.counter_generation + 1
+        ))
+        if result.rowcount:
+            refresh_top_scores(connection)
+            bump_resource_versions(connection, {"landmarks"})
+
+    return result.rowcount
+
+
+
+########################################################################## recounts likes, dislikes and comments of some landmarks in one statement, inside the caller's transaction
+def recount_landmarks(connection, landmark_ids):
+    landmark_ids = list(landmark_ids)
+    if not landmark_ids:
+        return 0
+
+    comment_count = select(func.count(Comment.id)).where(Comment.landmark_id == Landmark.id).scalar_subquery()
+    # the recount already includes every committed reaction, the new generation makes every process
+    # drop the deltas it still holds for these landmarks, but only once (and if) the caller commits
+    result = connection.execute(update(Landmark).where(Landmark.id.in_(landmark_ids)).values(
+        likes=reaction_count('like'),
+        dislikes=reaction_count('dislike'),
+        comment_count=comment_count,
+        counter_generation=Landmark.counter_generation + 1
+    ))
+    update_scores(connection, landmark_ids, {})
+    # reaction deletes no longer bump it on their own
+    bump_resource_versions(connection, {"landmarks"})
+    return result.rowcount
+
+
+
+########################################################################## every process asks for a reconcile now and then, the job key makes it one run for all of them
+def schedule_reconcile():
+    if jobs.workers_enabled():
+        jobs.enqueue_detached("reconcile_counters", key="reconcile_counters")
+    else:
+        reconcile_counters()
+
+
+@jobs.handler("reconcile_counters")
+def reconcile_counters_job(payload):
+    return {"corrected": reconcile_counters()}
+
+
+
+########################################################################## background thread that flushes (and now and then reconciles) the counters
+def _run_flusher(app):
+    interval = app.config["COUNTER_FLUSH_INTERVAL"]
+    reconcile_interval = app.config["COUNTER_RECONCILE_INTERVAL"]
+    last_reconcile = time.monotonic()
+
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                flush_counters()
+                if reconcile_interval and time.monotonic() - last_reconcile >= reconcile_interval:
+                    schedule_reconcile()
+                    last_reconcile = time.monotonic()
+            except Exception:
+                logger.exception("Could not flush reaction counters")
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    # threads do not survive a fork, every worker process starts its own
+    if _app is None or (_flusher is not None and _flusher_pid == os.getpid()):
+        return
+
+    with _lock:
+        if _flusher is not None and _flusher_pid == os.getpid():
+            return
+        _flusher = threading.Thread(target=_run_flusher, args=(_app,), name="counter-flusher", daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+def reset_after_fork():
+    global _lock, _flusher, _flusher_pid
+    # deltas still pending in the parent are flushed by the parent, not by every child
+    _lock = threading.Lock()
+    _pending.clear()
+    _generations.clear()
+    _flusher = None
+    _flusher_pid = None
+
+
+def _flush_at_exit():
+    if _app is None:
+        return
+    with _app.app_context():
+        try:
+            flush_counters()
+        except Exception:
+            logger.exception("Could not flush reaction counters on exit")
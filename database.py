@@ -0,0 +1,233 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import click
+from flask import g, request, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+# engine settings per environment, picked with DB_PROFILE
+PROFILES = {
+    "development": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "foreign_keys": "ON",
+            "cache_size": -16000,
+            "mmap_size": 64 * 1024 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 5,
+        "max_overflow": 5,
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 10000,
+            "foreign_keys": "ON",
+            "cache_size": -64000,
+            "mmap_size": 256 * 1024 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 10,
+        "max_overflow": 20,
+    },
+    # throwaway databases, durability does not matter
+    "test": {
+        "pragmas": {
+            "journal_mode": "MEMORY",
+            "synchronous": "OFF",
+            "busy_timeout": 5000,
+            "foreign_keys": "ON",
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 5,
+        "max_overflow": 5,
+    },
+}
+
+
+# read replicas are binds named replica0, replica1, ...
+REPLICA_BIND_PREFIX = "replica"
+
+# set after a write, until it expires the client's reads stay on the primary
+STICKY_COOKIE = "read_primary_until"
+
+
+def get_profile(app):
+    name = app.config.get("DB_PROFILE", "development")
+    if name not in PROFILES:
+        raise RuntimeError(f"Unknown DB_PROFILE {name!r}, expected one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+
+########################################################################## engine options (pooling, sqlite driver arguments) for a database uri
+def engine_options(uri, profile):
+    if not uri.startswith("sqlite"):
+        return {"pool_size": profile["pool_size"], "max_overflow": profile["max_overflow"], "pool_pre_ping": True}
+
+    options = {
+        # the busy timeout is set again by the pragma, this covers the connect itself
+        "connect_args": {"timeout": profile["pragmas"].get("busy_timeout", 5000) / 1000, "check_same_thread": False},
+    }
+    if ":memory:" not in uri and uri not in ("sqlite://", "sqlite:///"):
+        options.update(pool_size=profile["pool_size"], max_overflow=profile["max_overflow"], pool_timeout=30)
+    return options
+
+
+
+########################################################################## runs the profile's pragmas on every new sqlite connection
+def pragma_listener(pragmas):
+    def apply_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return apply_pragmas
+
+
+def configure(app):
+    profile = get_profile(app)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"], profile)
+
+    # every replica becomes a bind without models, only RoutingSession ever picks it
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    for index, uri in enumerate(app.config.get("SQLALCHEMY_REPLICA_URIS", [])):
+        binds[f"{REPLICA_BIND_PREFIX}{index}"] = {"url": uri, **engine_options(uri, profile)}
+
+
+def init_app(app, db):
+    profile = get_profile(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", pragma_listener(profile["pragmas"]))
+
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 10)
+    app.after_request(set_sticky_cookie)
+    app.cli.add_command(sqlite_load_test_command)
+
+
+
+########################################################################## sends reads of @read_replica views to a replica, everything else to the primary
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, "is_dml", False) and self.reads_from_replica():
+            replica = self.info.get("replica")
+            if replica is None:
+                replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)]
+                if replicas:
+                    # one replica per session so a request never mixes two snapshots
+                    replica = self.info["replica"] = random.choice(replicas)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self):
+        if self.info.get("wrote") or not has_request_context() or not g.get("read_replica"):
+            return False
+        # a client that wrote a moment ago reads from the primary until the replicas caught up
+        try:
+            return float(request.cookies.get(STICKY_COOKIE, 0)) <= time.time()
+        except ValueError:
+            return True
+
+
+
+########################################################################## remembers writes so the rest of the request and the client's next reads see them
+def mark_wrote(session):
+    # the flag lives as long as the session, which is removed at the end of every request
+    session.info["wrote"] = True
+    if has_request_context():
+        g.db_wrote = True
+
+def session_flushing(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        mark_wrote(session)
+
+def dml_executed(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mark_wrote(orm_execute_state.session)
+
+event.listen(RoutingSession, 'before_flush', session_flushing)
+event.listen(RoutingSession, 'do_orm_execute', dml_executed)
+
+
+def set_sticky_cookie(response):
+    if g.get("db_wrote"):
+        seconds = current_app.config["REPLICA_STICKY_SECONDS"]
+        response.set_cookie(
+            STICKY_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds,
+            httponly=True, secure=True, samesite="None"
+        )
+    return response
+
+
+
+########################################################################## readers and writers hammering one sqlite file for a few seconds
+def run_load_test(pragmas, readers, writers, seconds):
+    path = os.path.join(tempfile.mkdtemp(), "load.db")
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"timeout": 0.1, "check_same_thread": False},
+        pool_size=readers + writers
+    )
+    if pragmas:
+        event.listen(engine, "connect", pragma_listener(pragmas))
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)"))
+        connection.execute(text("INSERT INTO item (value) VALUES (:value)"), [{"value": i} for i in range(1000)])
+
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def work(is_writer):
+        done = locked = 0
+        while time.monotonic() < deadline:
+            try:
+                with engine.begin() as connection:
+                    if is_writer:
+                        connection.execute(text("UPDATE item SET value = value + 1 WHERE id = :id"), {"id": done % 1000 + 1})
+                        time.sleep(0.001)
+                    else:
+                        connection.execute(text("SELECT SUM(value) FROM item")).scalar()
+                done += 1
+            except OperationalError:
+                locked += 1
+        with lock:
+            counts["writes" if is_writer else "reads"] += done
+            counts["locked"] += locked
+
+    threads = [threading.Thread(target=work, args=(i < writers,)) for i in range(readers + writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    engine.dispose()
+    return {name: count / seconds for name, count in counts.items()}
+
+
+@click.command("sqlite-load-test")
+@click.option("--readers", default=8)
+@click.option("--writers", default=2)
+@click.option("--seconds", default=3.0)
+@click.option("--profile", default="production", type=click.Choice(list(PROFILES)))
+def sqlite_load_test_command(readers, writers, seconds, profile):
+    """Compare sqlite defaults with a tuning profile under concurrent load."""
+    print(f"{readers} readers, {writers} writers, {seconds:.0f}s each")
+    print(f"{'settings':<12} {'reads/s':>10} {'writes/s':>10} {'locked/s':>10}")
+    for name, pragmas in (("defaults", {}), (profile, PROFILES[profile]["pragmas"])):
+        result = run_load_test(pragmas, readers, writers, seconds)
+        print(f"{name:<12} {result['reads']:>10.0f} {result['writes']:>10.0f} {result['locked']:>10.0f}")
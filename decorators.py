@@ -1,8 +1,69 @@
 from functools import wraps
-from flask import request, jsonify, current_app  
+from flask import request, jsonify, current_app, g
 import jwt
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from extensions import db
-from models import User
+from cache import TTLCache
+from models import User, ResourceVersion
+
+
+# verified claims per token, an entry never outlives the token's own exp
+_claims_cache = TTLCache(maxsize=10000, ttl=300)
+
+# user id -> (status, "users" version it was read at). The process that changes a status drops its
+# entry, every other worker notices the version moved (any user write bumps it, see models.py)
+_status_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+########################################################################## decodes a token, or returns the claims we already verified for it
+def decode_token(token):
+    claims = _claims_cache.get(token)
+    if claims is not None:
+        if claims.get("exp") is not None and claims["exp"] <= time.time():
+            _claims_cache.delete(token)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return claims
+
+    claims = jwt.decode(
+        token,
+        current_app.config["SECRET_KEY"],
+        algorithms=["HS256"]
+    )
+
+    ttl = _claims_cache.ttl
+    if claims.get("exp") is not None:
+        ttl = min(ttl, claims["exp"] - time.time())
+    _claims_cache.set(token, claims, ttl)
+    return claims
+
+
+
+########################################################################## user's status without loading the whole user row
+def get_user_status(user_id):
+    version = db.session.query(ResourceVersion.version).filter_by(name="users").scalar() or 0
+    cached = _status_cache.get(user_id)
+    if cached is not None and cached[1] == version:
+        return cached[0]
+
+    row = db.session.query(User.id, User.status).filter_by(id=user_id).first()
+    if row is None:
+        return None
+
+    status = row.status or 'user'
+    _status_cache.set(user_id, (status, version))
+    return status
+
+
+def invalidate_user(user_id):
+    _status_cache.delete(user_id)
+
+
+# dropped once the session commits, a request reading the status before that would cache the old one again
+def invalidate_user_on_commit(session, user_id):
+    session.info.setdefault("invalidated_users", set()).add(user_id)
+
 
 
 ########################################################################## token_requred function
@@ -13,11 +74,7 @@ def token_required(f):
         if not token:
             return jsonify({"message": "Token is missing!"}), 401
         try:
-            data = jwt.decode(
-                token,
-                current_app.config["SECRET_KEY"],
-                algorithms=["HS256"]
-                )
+            data = decode_token(token)
             user_id = data["user_id"]
  
         except jwt.ExpiredSignatureError:
@@ -39,18 +96,14 @@ def admin_required(f):
         if not token:
             return jsonify({"message": "Token is missing!"}), 401
         try:
-            data = jwt.decode(
-                token,
-                current_app.config["SECRET_KEY"],
-                algorithms=["HS256"]
-            )
+            data = decode_token(token)
             user_id = data["user_id"]
-            user = db.session.get(User, user_id)
+            status = get_user_status(user_id)
 
-            if not user:
+            if not status:
                 return jsonify({"message": "User not found!"}), 401
 
-            if user.status != 'admin':
+            if status != 'admin':
                 return jsonify({"message": "Action reserved for admin only!"}), 403
 
         except jwt.ExpiredSignatureError:
@@ -74,11 +127,7 @@ def token_optional(f):
         
         if token:
             try:
-                data = jwt.decode(
-                    token,
-                    current_app.config["SECRET_KEY"],
-                    algorithms=["HS256"]
-                )
+                data = decode_token(token)
                 user_id = data["user_id"]
             except jwt.ExpiredSignatureError:
                 return jsonify({"message": "Token has expired!"}), 401
@@ -87,4 +136,37 @@ def token_optional(f):
         
         return f(user_id, *args, **kwargs)
     
-    return decorated
\ No newline at end of file
+    return decorated
+
+
+
+########################################################################## lets the view's reads go to a read replica (see database.RoutingSession)
+def read_replica(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_replica = True
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+
+########################################################################## keeps the status cache honest
+def user_status_changed(mapper, connection, target):
+    if db.inspect(target).attrs.status.history.has_changes():
+        invalidate_user_on_commit(db.inspect(target).session, target.id)
+
+def user_deleted(mapper, connection, target):
+    invalidate_user_on_commit(db.inspect(target).session, target.id)
+
+def invalidate_committed_users(session):
+    for user_id in session.info.pop("invalidated_users", ()):
+        invalidate_user(user_id)
+
+def forget_invalidated_users(session):
+    session.info.pop("invalidated_users", None)
+
+event.listen(User, 'after_update', user_status_changed)
+event.listen(User, 'after_delete', user_deleted)
+event.listen(Session, 'after_commit', invalidate_committed_users)
+event.listen(Session, 'after_rollback', forget_invalidated_users)
@@ -0,0 +1,147 @@
+from sqlalchemy import select, delete, func
+from extensions import db
+from models import User, Landmark, Comment, Reaction
+from clustering import remove_from_clusters
+from spatial import unindex_landmarks
+from search import unindex_documents
+from ranking import delete_scores
+from counters import recount_landmarks
+from images import prune_images, schedule_prune
+from decorators import invalidate_user_on_commit
+import jobs
+
+# Set-based deletes of users and landmarks. Rows go with DELETE ... WHERE IN statements instead of
+# one session.delete() per row, so none of the per-row mapper listeners run: the counters of the
+# landmarks that survive are recounted in one statement and the r-tree, clusters, search index and
+# scores are cleaned up here explicitly.
+
+# landmarks per transaction, each one takes its comments and reactions along
+LANDMARK_CHUNK_SIZE = 100
+# reactions and comments per transaction when a user's activity elsewhere is removed
+INTERACTION_CHUNK_SIZE = 500
+# deletes touching more rows than this run as a job, the endpoint answers with the job id
+DELETE_INLINE_LIMIT = 2000
+
+BULK = {"synchronize_session": False}
+
+
+########################################################################## rows a delete would remove, to choose between doing it inline and queueing a job
+def landmark_rows(landmark_ids):
+    on_landmarks = [
+        select(func.count(Reaction.reaction_id)).where(Reaction.landmark_id.in_(landmark_ids)).scalar_subquery(),
+        select(func.count(Comment.id)).where(Comment.landmark_id.in_(landmark_ids)).scalar_subquery(),
+    ]
+    return len(landmark_ids) + sum(db.session.execute(select(*on_landmarks)).one())
+
+
+def user_rows(user_id):
+    owned = select(Landmark.id).where(Landmark.user_id == user_id)
+    counts = db.session.execute(select(
+        select(func.count()).select_from(owned.subquery()).scalar_subquery(),
+        select(func.count(Reaction.reaction_id)).where(
+            (Reaction.user_id == user_id) | Reaction.landmark_id.in_(owned)
+        ).scalar_subquery(),
+        select(func.count(Comment.id)).where(
+            (Comment.user_id == user_id) | Comment.landmark_id.in_(owned)
+        ).scalar_subquery(),
+    )).one()
+    return 1 + sum(counts)
+
+
+
+########################################################################## removes landmarks with their reactions, comments and derived rows, returns their image hashes
+def delete_landmarks(landmark_ids):
+    session = db.session
+    landmarks = session.execute(
+        select(Landmark.id, Landmark.latitude, Landmark.longitude, Landmark.image_hash).where(Landmark.id.in_(landmark_ids))
+    ).all()
+    if not landmarks:
+        return []
+    landmark_ids = [landmark.id for landmark in landmarks]
+    comment_ids = session.scalars(select(Comment.id).where(Comment.landmark_id.in_(landmark_ids))).all()
+
+    session.execute(delete(Reaction).where(Reaction.landmark_id.in_(landmark_ids)), execution_options=BULK)
+    session.execute(delete(Comment).where(Comment.landmark_id.in_(landmark_ids)), execution_options=BULK)
+    connection = session.connection()
+    delete_scores(connection, landmark_ids)
+    session.execute(delete(Landmark).where(Landmark.id.in_(landmark_ids)), execution_options=BULK)
+
+    remove_from_clusters(connection, [(landmark.id, landmark.latitude, landmark.longitude) for landmark in landmarks])
+    unindex_landmarks(connection, landmark_ids)
+    unindex_documents(connection, landmark_ids, comment_ids)
+    return [landmark.image_hash for landmark in landmarks]
+
+
+
+########################################################################## removes one chunk of a user's reactions and comments on other landmarks, returns how many went
+def delete_user_interactions(user_id, limit=INTERACTION_CHUNK_SIZE):
+    session = db.session
+    reactions = session.execute(
+        select(Reaction.reaction_id, Reaction.landmark_id).where(Reaction.user_id == user_id).limit(limit)
+    ).all()
+    comments = session.execute(
+        select(Comment.id, Comment.landmark_id).where(Comment.user_id == user_id).limit(limit)
+    ).all()
+
+    if reactions:
+        session.execute(delete(Reaction).where(Reaction.reaction_id.in_([row[0] for row in reactions])), execution_options=BULK)
+    if comments:
+        comment_ids = [row[0] for row in comments]
+        session.execute(delete(Comment).where(Comment.id.in_(comment_ids)), execution_options=BULK)
+        unindex_documents(session.connection(), comment_ids=comment_ids)
+
+    recount_landmarks(session.connection(), {row[1] for row in reactions} | {row[1] for row in comments})
+    return len(reactions) + len(comments)
+
+
+
+########################################################################## removes a user and everything they created, committing after every chunk
+def delete_user_everything(user_id, progress=None):
+    session = db.session
+    user = session.execute(select(User.id, User.profile_picture_hash).where(User.id == user_id)).first()
+    if user is None:
+        return None
+    removed = {"landmarks": 0, "interactions": 0}
+
+    while True:
+        landmark_ids = session.scalars(
+            select(Landmark.id).where(Landmark.user_id == user_id).order_by(Landmark.id).limit(LANDMARK_CHUNK_SIZE)
+        ).all()
+        if not landmark_ids:
+            break
+        schedule_prune(delete_landmarks(landmark_ids))
+        session.commit()
+        removed["landmarks"] += len(landmark_ids)
+        if progress:
+            progress(dict(removed))
+
+    while True:
+        count = delete_user_interactions(user_id)
+        session.commit()
+        if not count:
+            break
+        removed["interactions"] += count
+        if progress:
+            progress(dict(removed))
+
+    session.execute(delete(User).where(User.id == user_id), execution_options=BULK)
+    invalidate_user_on_commit(session, user_id)
+    schedule_prune([user.profile_picture_hash])
+    session.commit()
+    return removed
+
+
+
+@jobs.handler("delete_user")
+def delete_user_job(payload):
+    removed = delete_user_everything(payload["user_id"], progress=jobs.report_progress)
+    # None when an earlier attempt got to the end already
+    return {"deleted": removed is not None, **(removed or {})}
+
+
+@jobs.handler("delete_landmark")
+def delete_landmark_job(payload):
+    image_hashes = delete_landmarks([payload["landmark_id"]])
+    prune_images(image_hashes)
+    db.session.commit()
+    return {"deleted": bool(image_hashes)}
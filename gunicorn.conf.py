@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+# production entry point: gunicorn -c gunicorn.conf.py wsgi:app  (or simply python wsgi.py)
+import multiprocessing
+import os
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+
+# one process per core does the CPU work, the threads cover requests waiting on sqlite or scrypt
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+
+keepalive = int(os.getenv("WEB_KEEPALIVE", 5))
+timeout = int(os.getenv("WEB_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+
+# recycling workers now and then keeps slow leaks from piling up
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", 1000))
+
+# the app is imported once in the master and shared copy-on-write with every worker
+preload_app = True
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("WEB_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    from wsgi import app, self_check
+    import metrics
+    for line in self_check(app):
+        server.log.info("self-check: %s", line)
+    server.log.info("self-check: %d workers x %d threads on %d cores", workers, threads, multiprocessing.cpu_count())
+    # counters start from zero with every run of the master, files of the previous one would add to them
+    metrics.clear_dir(app)
+
+
+def post_fork(server, worker):
+    from wsgi import app, after_fork
+    after_fork(app)
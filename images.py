@@ -0,0 +1,139 @@
+import hashlib
+import io
+import logging
+from PIL import Image as PILImage, ImageOps
+from extensions import db
+import jobs
+from models import Image, ImageVariant, Landmark, User
+from sqlalchemy.orm import undefer
+
+logger = logging.getLogger(__name__)
+
+# longest edge in pixels for every derivative we generate
+VARIANT_SIZES = {
+    "thumb": 160,
+    "card": 640,
+    "full": 1600,
+}
+VARIANT_FORMAT = "WEBP"
+VARIANT_MIME_TYPE = "image/webp"
+VARIANT_QUALITY = 82
+
+
+########################################################################## stores image bytes once, keyed by their sha256
+def store_image(data, mime_type):
+    image_hash = hashlib.sha256(data).hexdigest()
+
+    exists = db.session.query(Image.hash).filter_by(hash=image_hash).first()
+    if not exists:
+        db.session.add(Image(hash=image_hash, data=data, mime_type=mime_type, size=len(data)))
+
+    return image_hash
+
+
+
+########################################################################## re-encodes one image into a smaller one without any metadata
+def render_variant(source, max_size):
+    image = ImageOps.exif_transpose(source)
+    image.thumbnail((max_size, max_size), PILImage.Resampling.LANCZOS)
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    # saving without exif/icc/xmp arguments drops all of the original metadata
+    output = io.BytesIO()
+    image.save(output, format=VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+    return output.getvalue()
+
+
+
+########################################################################## generates and stores thumb/card/full variants of a stored image
+def generate_variants(source_hash):
+    source = db.session.get(Image, source_hash, options=[undefer(Image.data)])
+    if not source:
+        return []
+
+    existing = {v.variant for v in ImageVariant.query.filter_by(source_hash=source_hash)}
+    missing = [name for name in VARIANT_SIZES if name not in existing]
+    if not missing:
+        return []
+
+    try:
+        with PILImage.open(io.BytesIO(source.data)) as original:
+            original.load()
+            for name in missing:
+                data = render_variant(original, VARIANT_SIZES[name])
+                variant_hash = store_image(data, VARIANT_MIME_TYPE)
+                db.session.add(ImageVariant(source_hash=source_hash, variant=name, image_hash=variant_hash))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Could not generate variants for image %s", source_hash)
+        # the job is retried with backoff
+        raise
+    return missing
+
+
+
+########################################################################## queues the variant pipeline, it runs once the caller's transaction commits
+def schedule_variants(source_hash, user_id=None):
+    return jobs.enqueue("image_variants", {"source_hash": source_hash}, key=f"image_variants:{source_hash}", user_id=user_id)
+
+
+@jobs.handler("image_variants")
+def image_variants_job(payload):
+    return {"generated": generate_variants(payload["source_hash"])}
+
+
+
+def referenced_images(image_hashes):
+    if not image_hashes:
+        return set()
+    return {
+        row[0] for row in
+        db.session.query(Landmark.image_hash).filter(Landmark.image_hash.in_(image_hashes)).union(
+            db.session.query(ImageVariant.image_hash).filter(ImageVariant.image_hash.in_(image_hashes)),
+            db.session.query(User.profile_picture_hash).filter(User.profile_picture_hash.in_(image_hashes))
+        )
+    }
+
+
+
+########################################################################## removes images (and their variants) that are no longer referenced
+def prune_images(image_hashes):
+    image_hashes = {h for h in image_hashes if h}
+    if not image_hashes:
+        return
+
+    db.session.flush()
+    referenced = referenced_images(image_hashes)
+
+    orphaned = image_hashes - referenced
+    if not orphaned:
+        return
+
+    variant_hashes = {
+        row.image_hash for row in
+        db.session.query(ImageVariant.image_hash).filter(ImageVariant.source_hash.in_(orphaned))
+    }
+    ImageVariant.query.filter(ImageVariant.source_hash.in_(orphaned)).delete(synchronize_session=False)
+
+    # a variant can share its bytes with another upload, keep those
+    still_used = referenced_images(variant_hashes)
+
+    Image.query.filter(Image.hash.in_(orphaned | (variant_hashes - still_used))).delete(synchronize_session=False)
+
+
+
+########################################################################## queues prune_images for images the caller's transaction stops referencing
+def schedule_prune(image_hashes):
+    image_hashes = sorted({h for h in image_hashes if h})
+    if image_hashes:
+        # the job checks the references again, an image picked up meanwhile is kept
+        return jobs.enqueue("prune_images", {"image_hashes": image_hashes})
+
+
+@jobs.handler("prune_images")
+def prune_images_job(payload):
+    prune_images(payload["image_hashes"])
+    db.session.commit()
@@ -0,0 +1,316 @@
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from flask import g, has_request_context, current_app
+from sqlalchemy import event, select, update, delete, or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+# kind -> function(payload) returning a json-able result, see handler()
+_handlers = {}
+
+_app = None
+_workers = []
+_workers_pid = None
+_lock = threading.Lock()
+_wakeup = threading.Event()
+# (job id, worker id) of the job the current thread is running, see report_progress()
+_running = threading.local()
+
+# INSERT ... ON CONFLICT DO NOTHING per dialect, for keyed jobs
+KEYED_INSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def init_app(app):
+    global _app
+    _app = app
+    # worker threads per process, 0 runs a request's jobs right after its response is built
+    app.config.setdefault("JOB_WORKERS", 2)
+    app.config.setdefault("JOB_POLL_INTERVAL", 1.0)
+    # a job still running after this long is considered abandoned and claimed again
+    app.config.setdefault("JOB_LEASE_SECONDS", 300)
+    app.config.setdefault("JOB_MAX_ATTEMPTS", 5)
+    # failed runs wait base * 2^(attempt - 1) seconds, at most JOB_BACKOFF_MAX, before the next one
+    app.config.setdefault("JOB_BACKOFF_BASE", 2.0)
+    app.config.setdefault("JOB_BACKOFF_MAX", 600.0)
+    app.config.setdefault("JOB_RETENTION_DAYS", 7)
+
+    app.before_request(ensure_workers)
+    app.after_request(run_inline_jobs)
+
+
+def workers_enabled():
+    return (_app or current_app).config["JOB_WORKERS"] > 0
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+
+########################################################################## registers the function that runs jobs of one kind
+def handler(kind):
+    def register(f):
+        _handlers[kind] = f
+        return f
+    return register
+
+
+
+########################################################################## adds a job to the session, it is only visible to workers once the session commits
+def enqueue(kind, payload=None, key=None, delay=0, max_attempts=None, user_id=None, session=None):
+    session = session or db.session
+    values = dict(
+        kind=kind,
+        payload=payload or {},
+        key=key,
+        run_at=utcnow() + datetime.timedelta(seconds=delay),
+        max_attempts=max_attempts or (_app or current_app).config["JOB_MAX_ATTEMPTS"],
+        # the user who asked for it may follow the job through GET /jobs/<id>
+        user_id=user_id
+    )
+
+    if key is None:
+        job = Job(**values)
+        session.add(job)
+    else:
+        # one queued job per key is enough, it has not started yet and will see the latest data.
+        # uq_job_queued_key settles racing requests in the insert itself, the loser gets the winner's job
+        insert = KEYED_INSERT[session.get_bind(Job).dialect.name]
+        job_id = session.execute(
+            insert(Job).values(status='queued', attempts=0, created_at=utcnow(), **values)
+            .on_conflict_do_nothing(index_elements=[Job.key], index_where=Job.status == 'queued')
+            .returning(Job.id)
+        ).scalar()
+        if job_id is None:
+            return session.execute(select(Job).where(Job.key == key, Job.status == 'queued')).scalar_one()
+        job = session.get(Job, job_id)
+
+    session.info.setdefault("enqueued_jobs", []).append(job)
+    return job
+
+
+def requeue(job, session=None):
+    session = session or db.session
+    if job.key is not None:
+        # the queued one does the same work
+        queued = session.execute(select(Job).where(Job.key == job.key, Job.status == 'queued')).scalar()
+        if queued is not None:
+            return queued
+    job.status = 'queued'
+    job.attempts = 0
+    job.run_at = utcnow()
+    job.finished_at = None
+    session.info.setdefault("enqueued_jobs", []).append(job)
+    return job
+
+
+########################################################################## enqueues in a transaction of its own, for callers that are not inside one (or just ended one)
+def enqueue_detached(kind, payload=None, key=None, delay=0, max_attempts=None):
+    with Session(db.engine) as session, session.begin():
+        job = enqueue(kind, payload, key, delay, max_attempts, session=session)
+        session.flush()
+        return job.id
+
+
+
+########################################################################## wakes the local workers once enqueued jobs are committed
+def wake_on_commit(session):
+    jobs = session.info.pop("enqueued_jobs", None)
+    if not jobs:
+        return
+    # the instances are expired by the commit, their identity still holds the id
+    job_ids = [db.inspect(job).identity[0] for job in jobs if db.inspect(job).identity]
+
+    if _app is not None and not workers_enabled():
+        if has_request_context():
+            g.setdefault("inline_jobs", []).extend(job_ids)
+        return
+    _wakeup.set()
+    ensure_workers()
+
+def forget_on_rollback(session):
+    session.info.pop("enqueued_jobs", None)
+
+event.listen(Session, 'after_commit', wake_on_commit)
+event.listen(Session, 'after_rollback', forget_on_rollback)
+
+
+
+########################################################################## takes the next due job (or the given one) for this worker, None when there is nothing to do
+def claim_job(worker_id, job_id=None):
+    now = utcnow()
+    lease = datetime.timedelta(seconds=(_app or current_app).config["JOB_LEASE_SECONDS"])
+    claimable = or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_until < now)
+    )
+
+    if job_id is None:
+        # a plain read first, polling an empty queue must not take the write lock
+        with db.engine.connect() as connection:
+            job_id = connection.execute(
+                select(Job.id).where(claimable).order_by(Job.run_at, Job.id).limit(1)
+            ).scalar()
+        if job_id is None:
+            return None
+
+    # whoever updates the row first owns the job, everyone else sees rowcount 0
+    with db.engine.begin() as connection:
+        result = connection.execute(update(Job).where(Job.id == job_id, claimable).values(
+            status='running',
+            attempts=Job.attempts + 1,
+            locked_by=worker_id,
+            locked_until=now + lease
+        ))
+    return job_id if result.rowcount == 1 else None
+
+
+
+########################################################################## runs a claimed job and records how it went
+def run_claimed_job(job_id, worker_id):
+    with db.engine.connect() as connection:
+        job = connection.execute(
+            select(Job.kind, Job.payload, Job.attempts, Job.max_attempts).where(Job.id == job_id)
+        ).one()
+
+    fn = _handlers.get(job.kind)
+    _running.job = (job_id, worker_id)
+    try:
+        if fn is None:
+            raise LookupError(f"No handler for job kind {job.kind}")
+        if job.attempts > job.max_attempts:
+            # claimed again after its lease ran out too many times, most likely it kills the worker
+            raise RuntimeError("Job was abandoned too many times")
+        result = fn(job.payload)
+    except Exception:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed on attempt %s", job_id, job.kind, job.attempts)
+        retry = fn is not None and job.attempts < job.max_attempts
+        config = (_app or current_app).config
+        backoff = min(config["JOB_BACKOFF_MAX"], config["JOB_BACKOFF_BASE"] * 2 ** (job.attempts - 1))
+        last_error = traceback.format_exc()[-2000:]
+        try:
+            finish_job(job_id, worker_id,
+                status='queued' if retry else 'failed',
+                run_at=utcnow() + datetime.timedelta(seconds=backoff * random.uniform(0.5, 1.0)),
+                last_error=last_error,
+                finished_at=None if retry else utcnow()
+            )
+        except IntegrityError:
+            # a newer job with the same key is queued and does the same work, this one gives up
+            finish_job(job_id, worker_id, status='failed', last_error=last_error, finished_at=utcnow())
+        return False
+    finally:
+        _running.job = None
+        db.session.remove()
+
+    finish_job(job_id, worker_id, status='succeeded', result=result, finished_at=utcnow())
+    return True
+
+
+########################################################################## lets a long job publish how far it got as its result, which also renews its lease
+def report_progress(result):
+    job = getattr(_running, "job", None)
+    if job is None:
+        return
+    job_id, worker_id = job
+    lease = datetime.timedelta(seconds=(_app or current_app).config["JOB_LEASE_SECONDS"])
+    with db.engine.begin() as connection:
+        connection.execute(update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(
+            result=result, locked_until=utcnow() + lease
+        ))
+
+
+def finish_job(job_id, worker_id, **values):
+    # a worker whose lease ran out must not overwrite the run that took over
+    with db.engine.begin() as connection:
+        connection.execute(update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(
+            locked_by=None, locked_until=None, **values
+        ))
+
+
+
+########################################################################## finished jobs are kept JOB_RETENTION_DAYS for the status endpoints
+def prune_jobs():
+    cutoff = utcnow() - datetime.timedelta(days=(_app or current_app).config["JOB_RETENTION_DAYS"])
+    with db.engine.begin() as connection:
+        return connection.execute(delete(Job).where(
+            Job.status.in_(('succeeded', 'failed')),
+            Job.finished_at < cutoff
+        )).rowcount
+
+
+
+########################################################################## worker loop, runs due jobs until the queue is empty then waits for a commit or the next poll
+def work(app, worker_id, stop=None):
+    interval = app.config["JOB_POLL_INTERVAL"]
+    last_prune = None
+
+    while stop is None or not stop.is_set():
+        with app.app_context():
+            try:
+                job_id = claim_job(worker_id)
+                if job_id is not None:
+                    run_claimed_job(job_id, worker_id)
+                    continue
+                if last_prune is None or utcnow() - last_prune > datetime.timedelta(hours=1):
+                    prune_jobs()
+                    last_prune = utcnow()
+            except Exception:
+                logger.exception("Job worker %s could not poll the queue", worker_id)
+
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def ensure_workers():
+    global _workers, _workers_pid
+    # threads do not survive a fork, every worker process starts its own
+    if _app is None or not workers_enabled() or (_workers and _workers_pid == os.getpid()):
+        return
+
+    with _lock:
+        if _workers and _workers_pid == os.getpid():
+            return
+        _workers = [
+            threading.Thread(target=work, args=(_app, worker_name()), name=f"job-worker-{index}", daemon=True)
+            for index in range(_app.config["JOB_WORKERS"])
+        ]
+        _workers_pid = os.getpid()
+        for thread in _workers:
+            thread.start()
+
+
+def reset_after_fork():
+    global _lock, _workers, _workers_pid
+    _lock = threading.Lock()
+    _wakeup.clear()
+    _workers = []
+    _workers_pid = None
+
+
+
+########################################################################## JOB_WORKERS = 0: the jobs a request committed run before its response goes out
+def run_inline_jobs(response):
+    # a job may queue jobs of its own, like a user deletion queueing image pruning
+    while g.get("inline_jobs"):
+        for job_id in g.pop("inline_jobs"):
+            worker_id = f"inline:{worker_name()}"
+            if claim_job(worker_id, job_id) is not None:
+                run_claimed_job(job_id, worker_id)
+    return response
@@ -0,0 +1,46 @@
+from flask.json.provider import DefaultJSONProvider
+from metrics import timed_serialization
+
+try:
+    import orjson
+except ImportError:
+    # the stdlib encoder of DefaultJSONProvider takes over
+    orjson = None
+
+
+########################################################################## flask json provider that encodes with orjson when it is installed
+class FastJSONProvider(DefaultJSONProvider):
+    # keyword arguments the orjson path understands, anything else goes to the stdlib encoder
+    ORJSON_KWARGS = {"default", "sort_keys", "separators"}
+
+    def dumpb(self, obj, **kwargs):
+        if orjson is not None and kwargs.keys() <= self.ORJSON_KWARGS and kwargs.get("separators", (",", ":")) == (",", ":"):
+            # dates and dataclasses still go through flask's default() so the output matches jsonify's
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            if kwargs.get("sort_keys", self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option)
+            except orjson.JSONEncodeError:
+                # integers past 64 bits and the like, the stdlib encoder copes with them
+                pass
+
+        kwargs.setdefault("separators", (",", ":"))
+        return super().dumps(obj, **kwargs).encode()
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj, **kwargs).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            # pretty printed debug output is the stdlib's job
+            return super().response(obj)
+        with timed_serialization():
+            body = self.dumpb(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
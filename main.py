@@ -1,6 +1,8 @@
+import os
 from config import app, db
 
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
-    app.run(debug=True, host="localhost")
\ No newline at end of file
+    # development server only, production runs through wsgi.py / gunicorn.conf.py
+    app.run(debug=os.getenv("FLASK_DEBUG", "1") == "1", host="localhost")
\ No newline at end of file
@@ -0,0 +1,396 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Request metrics in prometheus' text format, without prometheus_client. Every process keeps its
+# own numbers, with METRICS_DIR set each one also writes them to a file there and /metrics adds
+# up the files of all processes (gunicorn's workers, including the ones already recycled).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SERIALIZATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (type, help, label names, buckets)
+METRICS = {
+    "http_requests_total": (
+        "counter", "Requests handled.", ("endpoint", "method", "status"), None),
+    "http_request_duration_seconds": (
+        "histogram", "Time from the first before_request hook until the response body was produced.",
+        ("endpoint", "method"), LATENCY_BUCKETS),
+    "http_response_size_bytes": (
+        "histogram", "Bytes in the response body.", ("endpoint",), SIZE_BUCKETS),
+    "http_response_serialization_seconds": (
+        "histogram", "Time spent encoding the response body as json.", ("endpoint",), SERIALIZATION_BUCKETS),
+    "http_request_db_queries": (
+        "histogram", "SQL statements executed per request.", ("endpoint",), QUERY_COUNT_BUCKETS),
+    "http_request_db_seconds": (
+        "histogram", "Time spent executing SQL per request.", ("endpoint",), LATENCY_BUCKETS),
+    "db_query_duration_seconds": (
+        "histogram", "Duration of the single SQL statements executed by requests.", ("endpoint",), QUERY_BUCKETS),
+    "http_slow_requests_total": (
+        "counter", "Requests that took longer than METRICS_SLOW_REQUEST_SECONDS.", ("endpoint",), None),
+}
+
+# name -> {label values: value}, a histogram's value is [count per bucket..., count above the last bucket, sum]
+_values = {name: {} for name in METRICS}
+_lock = threading.Lock()
+
+_app = None
+_writer = None
+_writer_pid = None
+# this process' file in METRICS_DIR, a new one after every fork. Held while the file is written or
+# retired, so the writer thread never puts back a file _retire_at_exit already folded into retired.json
+_file = None
+_file_lock = threading.Lock()
+
+RETIRED_FILE = "retired.json"
+LOCK_FILE = "metrics.lock"
+
+
+def init_app(app):
+    global _app
+    _app = app
+    # requests slower than this are logged with the SQL they ran, 0 turns the log off
+    app.config.setdefault("METRICS_SLOW_REQUEST_SECONDS", 1.0)
+    # statements listed per slow request, those that took the most time in total first
+    app.config.setdefault("METRICS_SLOW_SQL_STATEMENTS", 10)
+    # bearer token GET /metrics asks for. Without one it answers only in debug or testing mode, or
+    # with METRICS_PUBLIC set, endpoints, traffic and latencies are nothing to publish by accident
+    app.config.setdefault("METRICS_TOKEN", None)
+    app.config.setdefault("METRICS_PUBLIC", False)
+    app.config.setdefault("METRICS_DIR", None)
+    app.config.setdefault("METRICS_WRITE_INTERVAL", 5.0)
+
+    # registered before every other hook, so its before_request runs first and its after_request last
+    app.before_request(start_request)
+    app.after_request(measure_response)
+    app.teardown_request(record_request)
+    atexit.register(_retire_at_exit)
+
+
+
+########################################################################## per request numbers, collected in g until the request is torn down
+def start_request():
+    g.request_metrics = {
+        "started": time.perf_counter(),
+        "status": 500,
+        "bytes": 0,
+        "serialization": 0.0,
+        # durations of every statement, and statement text -> [executions, seconds] for the slow log
+        "queries": [],
+        "statements": {},
+    }
+    _ensure_writer()
+
+
+def current_metrics():
+    if not has_request_context():
+        return None
+    return g.get("request_metrics")
+
+
+def measure_response(response):
+    stats = current_metrics()
+    if stats is None:
+        return response
+    stats["status"] = response.status_code
+    if response.is_streamed and response.content_length is None:
+        # counted as the chunks go out, stream_with_context tears the request down after the last one
+        response.response = CountingIterable(response.response, stats)
+    else:
+        stats["bytes"] = response.content_length or 0
+    return response
+
+
+class CountingIterable:
+    def __init__(self, iterable, stats):
+        self.iterable = iterable
+        self.stats = stats
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.stats["bytes"] += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.iterable, "close"):
+            self.iterable.close()
+
+
+@contextmanager
+def timed_serialization():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_metrics()
+        if stats is not None:
+            stats["serialization"] += time.perf_counter() - started
+
+
+
+########################################################################## times every statement a request executes, on every engine including the replicas
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    # one statement at a time per connection, a failed one is simply overwritten by the next
+    conn.info["query_started"] = time.perf_counter()
+
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    stats = current_metrics()
+    if started is None or stats is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats["queries"].append(elapsed)
+    executed = stats["statements"].get(statement)
+    if executed is None:
+        stats["statements"][statement] = [1, elapsed]
+    else:
+        executed[0] += 1
+        executed[1] += elapsed
+
+event.listen(Engine, "before_cursor_execute", start_query)
+event.listen(Engine, "after_cursor_execute", end_query)
+
+
+
+########################################################################## folds a finished request into the metrics and logs it when it was slow
+def record_request(exc=None):
+    stats = g.pop("request_metrics", None)
+    if stats is None or request.endpoint == "metrics.get_metrics":
+        return
+    elapsed = time.perf_counter() - stats["started"]
+    endpoint = request.endpoint or "unmatched"
+    db_seconds = sum(stats["queries"])
+    slow_after = _app.config["METRICS_SLOW_REQUEST_SECONDS"]
+    slow = bool(slow_after) and elapsed >= slow_after
+
+    with _lock:
+        _inc("http_requests_total", (endpoint, request.method, str(stats["status"])))
+        _observe("http_request_duration_seconds", (endpoint, request.method), elapsed)
+        _observe("http_response_size_bytes", (endpoint,), stats["bytes"])
+        _observe("http_response_serialization_seconds", (endpoint,), stats["serialization"])
+        _observe("http_request_db_queries", (endpoint,), len(stats["queries"]))
+        _observe("http_request_db_seconds", (endpoint,), db_seconds)
+        for seconds in stats["queries"]:
+            _observe("db_query_duration_seconds", (endpoint,), seconds)
+        if slow:
+            _inc("http_slow_requests_total", (endpoint,))
+
+    if slow:
+        log_slow_request(endpoint, elapsed, db_seconds, stats)
+
+
+def log_slow_request(endpoint, elapsed, db_seconds, stats):
+    worst = sorted(stats["statements"].items(), key=lambda item: item[1][1], reverse=True)
+    worst = worst[:_app.config["METRICS_SLOW_SQL_STATEMENTS"]]
+    lines = [
+        f"  {count}x {seconds * 1000:.1f} ms  {' '.join(statement.split())[:1000]}"
+        for statement, (count, seconds) in worst
+    ]
+    logger.warning(
+        "Slow request %s %s (%s) took %.3f s: %d statements in %.3f s, %.3f s serializing, %d bytes%s",
+        request.method, request.full_path.rstrip("?"), endpoint, elapsed, len(stats["queries"]), db_seconds,
+        stats["serialization"], stats["bytes"], "".join("\n" + line for line in lines)
+    )
+
+
+# callers hold _lock
+def _inc(name, labels, amount=1):
+    series = _values[name]
+    series[labels] = series.get(labels, 0) + amount
+
+def _observe(name, labels, value):
+    buckets = METRICS[name][3]
+    series = _values[name].get(labels)
+    if series is None:
+        series = _values[name][labels] = [0] * (len(buckets) + 1) + [0.0]
+    series[bisect_left(buckets, value)] += 1
+    series[-1] += value
+
+
+
+########################################################################## copies of the numbers, as written to METRICS_DIR and added up by /metrics
+def snapshot():
+    with _lock:
+        return {
+            name: [[list(labels), list(value) if isinstance(value, list) else value] for labels, value in series.items()]
+            for name, series in _values.items()
+        }
+
+
+def merge(into, snapshot):
+    for name, series in snapshot.items():
+        if name not in into:
+            # written by an older version of the app
+            continue
+        for labels, value in series:
+            labels = tuple(labels)
+            current = into[name].get(labels)
+            if current is None:
+                into[name][labels] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                if len(value) == len(current):
+                    into[name][labels] = [a + b for a, b in zip(current, value)]
+            else:
+                into[name][labels] = current + value
+    return into
+
+
+def collect():
+    values = merge({name: {} for name in METRICS}, snapshot())
+    directory = _app.config["METRICS_DIR"]
+    if not directory:
+        return values
+
+    with _dir_lock(directory, fcntl.LOCK_SH):
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            if path == _file:
+                # the live numbers above are newer than what the writer put there
+                continue
+            try:
+                with open(path) as f:
+                    merge(values, json.load(f))
+            except (OSError, ValueError):
+                logger.exception("Could not read metrics from %s", path)
+    return values
+
+
+
+########################################################################## prometheus text exposition format
+def render(values):
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(values[name].items()):
+            label_text = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(label_names, labels))
+            if kind == "counter":
+                lines.append(f"{name}{{{label_text}}} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float("inf"),), value):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {value[-1]}")
+            lines.append(f"{name}_count{{{label_text}}} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+
+########################################################################## METRICS_DIR: every process writes its numbers to a file of its own now and then
+@contextmanager
+def _dir_lock(directory, mode):
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_json(path, data):
+    # readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def write_snapshot():
+    with _file_lock:
+        # None before the first request and once the process retired its numbers
+        if _file is not None:
+            _write_json(_file, snapshot())
+
+
+def _run_writer(app):
+    while True:
+        time.sleep(app.config["METRICS_WRITE_INTERVAL"])
+        try:
+            write_snapshot()
+        except OSError:
+            logger.exception("Could not write metrics to %s", app.config["METRICS_DIR"])
+
+
+def _ensure_writer():
+    global _writer, _writer_pid, _file
+    # threads do not survive a fork, every worker process starts its own
+    if not _app.config["METRICS_DIR"] or (_writer is not None and _writer_pid == os.getpid()):
+        return
+
+    with _lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            return
+        os.makedirs(_app.config["METRICS_DIR"], exist_ok=True)
+        _file = os.path.join(_app.config["METRICS_DIR"], f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        _writer = threading.Thread(target=_run_writer, args=(_app,), name="metrics-writer", daemon=True)
+        _writer_pid = os.getpid()
+        _writer.start()
+
+
+def reset_after_fork():
+    global _lock, _file_lock, _writer, _writer_pid, _file
+    # the parent's requests are the parent's, a worker starts from zero
+    _lock = threading.Lock()
+    _file_lock = threading.Lock()
+    for series in _values.values():
+        series.clear()
+    _writer = None
+    _writer_pid = None
+    _file = None
+
+
+# a recycled worker adds its numbers to retired.json, so the directory does not grow with every restart
+def _retire_at_exit():
+    global _file
+    if _app is None or not _app.config["METRICS_DIR"] or _file is None:
+        return
+    directory = _app.config["METRICS_DIR"]
+    path = os.path.join(directory, RETIRED_FILE)
+    try:
+        with _file_lock, _dir_lock(directory, fcntl.LOCK_EX):
+            own, _file = _file, None
+            if own is None:
+                return
+            retired = {name: {} for name in METRICS}
+            if os.path.exists(path):
+                with open(path) as f:
+                    merge(retired, json.load(f))
+            merge(retired, snapshot())
+            _write_json(path, {
+                name: [[list(labels), value] for labels, value in series.items()] for name, series in retired.items()
+            })
+            if os.path.exists(own):
+                os.remove(own)
+    except (OSError, ValueError):
+        logger.exception("Could not retire metrics to %s", path)
+
+
+# the gunicorn master starts every run from empty counters
+def clear_dir(app):
+    directory = app.config["METRICS_DIR"]
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
@@ -0,0 +1,37 @@
+"""Comment count and index
+
+Revision ID: 056483551468
+Revises: fb9bc175d31a
+Create Date: 2026-10-18 14:52:30.617225
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '056483551468'
+down_revision = 'fb9bc175d31a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute(
+        "UPDATE landmark SET comment_count = "
+        "(SELECT COUNT(*) FROM comment WHERE comment.landmark_id = landmark.id)"
+    )
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_landmark_date', ['landmark_id', 'date_of_creation'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_landmark_date')
+
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
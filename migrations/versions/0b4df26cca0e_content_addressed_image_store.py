@@ -0,0 +1,73 @@
+"""Content addressed image store
+
+Revision ID: 0b4df26cca0e
+Revises: 1e80db13ec72
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = '0b4df26cca0e'
+down_revision = '1e80db13ec72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('mime_type', sa.String(length=20), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('hash')
+    )
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_hash', sa.String(length=64), nullable=True))
+
+    # move every landmark blob into the image table, storing duplicates once
+    bind = op.get_bind()
+    image = sa.table('image',
+        sa.column('hash', sa.String), sa.column('data', sa.LargeBinary),
+        sa.column('mime_type', sa.String), sa.column('size', sa.Integer))
+    landmark = sa.table('landmark',
+        sa.column('id', sa.Integer), sa.column('image_data', sa.LargeBinary),
+        sa.column('mime_type', sa.String), sa.column('image_hash', sa.String))
+
+    stored = set()
+    for row in bind.execute(sa.select(landmark.c.id, landmark.c.image_data, landmark.c.mime_type)).fetchall():
+        image_hash = hashlib.sha256(row.image_data).hexdigest()
+        if image_hash not in stored:
+            bind.execute(image.insert().values(
+                hash=image_hash, data=row.image_data, mime_type=row.mime_type, size=len(row.image_data)))
+            stored.add(image_hash)
+        bind.execute(landmark.update().where(landmark.c.id == row.id).values(image_hash=image_hash))
+
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.alter_column('image_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_foreign_key('fk_landmark_image_hash', 'image', ['image_hash'], ['hash'])
+        batch_op.drop_column('image_data')
+        batch_op.drop_column('mime_type')
+
+
+def downgrade():
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('mime_type', sa.VARCHAR(length=20), nullable=True))
+        batch_op.add_column(sa.Column('image_data', sa.BLOB(), nullable=True))
+
+    op.execute(
+        "UPDATE landmark SET "
+        "image_data = (SELECT data FROM image WHERE image.hash = landmark.image_hash), "
+        "mime_type = (SELECT mime_type FROM image WHERE image.hash = landmark.image_hash)"
+    )
+
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_landmark_image_hash', type_='foreignkey')
+        batch_op.drop_column('image_hash')
+        batch_op.alter_column('image_data', existing_type=sa.BLOB(), nullable=False)
+        batch_op.alter_column('mime_type', existing_type=sa.VARCHAR(length=20), nullable=False)
+
+    op.drop_table('image')
@@ -0,0 +1,38 @@
+"""Landmark spatial index
+
+Revision ID: 3d1d16f96e88
+Revises: af9a65a605c9
+Create Date: 2026-10-18 12:41:09.385512
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3d1d16f96e88'
+down_revision = 'af9a65a605c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.create_index('ix_landmark_lat_lon', ['latitude', 'longitude'], unique=False)
+
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS landmark_rtree "
+            "USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+        )
+        op.execute(
+            "INSERT INTO landmark_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+            "SELECT id, latitude, latitude, longitude, longitude FROM landmark"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS landmark_rtree")
+
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.drop_index('ix_landmark_lat_lon')
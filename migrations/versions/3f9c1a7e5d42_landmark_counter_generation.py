@@ -0,0 +1,26 @@
+"""Landmark counter generation
+
+Revision ID: 3f9c1a7e5d42
+Revises: 8b3e6f0a4d27
+Create Date: 2026-10-19 09:12:44.201937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1a7e5d42'
+down_revision = '8b3e6f0a4d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('counter_generation', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('landmark', schema=None) as batch_op:
+        batch_op.drop_column('counter_generation')
@@ -0,0 +1,32 @@
+"""Unique queued job key
+
+Revision ID: 5a2d8c4e1b7f
+Revises: 3f9c1a7e5d42
+Create Date: 2026-10-19 14:37:05.518220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a2d8c4e1b7f'
+down_revision = '3f9c1a7e5d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # duplicates queued by racing requests would do the same work, the oldest one stays
+    op.execute(
+        "DELETE FROM job WHERE status = 'queued' AND key IS NOT NULL AND id NOT IN "
+        "(SELECT MIN(id) FROM job WHERE status = 'queued' AND key IS NOT NULL GROUP BY key)"
+    )
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('uq_job_queued_key', ['key'], unique=True,
+            sqlite_where=sa.text("status = 'queued'"), postgresql_where=sa.text("status = 'queued'"))
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('uq_job_queued_key')
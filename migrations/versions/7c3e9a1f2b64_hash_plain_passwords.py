@@ -0,0 +1,36 @@
+"""Hash plain passwords
+
+Revision ID: 7c3e9a1f2b64
+Revises: 5a2d8c4e1b7f
+Create Date: 2026-10-20 10:21:37.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+from passwords import SCHEME, hash_password_sync
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1f2b64'
+down_revision = '5a2d8c4e1b7f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # accounts from before hashing kept their plain password until the next login, dormant ones forever
+    connection = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('password', sa.String))
+    cost = (current_app.config["PASSWORD_SCRYPT_N"], current_app.config["PASSWORD_SCRYPT_R"], current_app.config["PASSWORD_SCRYPT_P"])
+
+    plain = connection.execute(sa.select(user.c.id, user.c.password).where(
+        user.c.password.is_not(None), sa.not_(user.c.password.startswith(SCHEME + "$"))
+    )).all()
+    for user_id, password in plain:
+        connection.execute(user.update().where(user.c.id == user_id).values(password=hash_password_sync(password, *cost)))
+
+
+def downgrade():
+    # hashes cannot be turned back into passwords, hashed accounts keep working after a downgrade
+    pass
@@ -0,0 +1,37 @@
+"""Landmark search index
+
+Revision ID: a6cc1483e51c
+Revises: 5e8f2a7c41b9
+Create Date: 2026-10-18 18:41:27.208514
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6cc1483e51c'
+down_revision = '5e8f2a7c41b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "title, body, landmark_id UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute("INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)')")
+        op.execute(
+            "INSERT INTO search_index (rowid, title, body, landmark_id) "
+            "SELECT id * 2, name, description, id FROM landmark"
+        )
+        op.execute(
+            "INSERT INTO search_index (rowid, title, body, landmark_id) "
+            "SELECT id * 2 + 1, '', text, landmark_id FROM comment"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS search_index")
@@ -0,0 +1,67 @@
+"""Profile pictures in image store
+
+Revision ID: af9a65a605c9
+Revises: 1b005964b302
+Create Date: 2026-10-18 11:20:53.740118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = 'af9a65a605c9'
+down_revision = '1b005964b302'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_hash', sa.String(length=64), nullable=True))
+
+    # move every profile picture blob into the image table, storing duplicates once
+    bind = op.get_bind()
+    image = sa.table('image',
+        sa.column('hash', sa.String), sa.column('data', sa.LargeBinary),
+        sa.column('mime_type', sa.String), sa.column('size', sa.Integer))
+    user = sa.table('user',
+        sa.column('id', sa.Integer), sa.column('profile_picture_data', sa.LargeBinary),
+        sa.column('profile_picture_type', sa.String), sa.column('profile_picture_hash', sa.String))
+
+    stored = {row.hash for row in bind.execute(sa.select(image.c.hash)).fetchall()}
+    rows = bind.execute(
+        sa.select(user.c.id, user.c.profile_picture_data, user.c.profile_picture_type)
+        .where(user.c.profile_picture_data.isnot(None))
+    ).fetchall()
+    for row in rows:
+        image_hash = hashlib.sha256(row.profile_picture_data).hexdigest()
+        if image_hash not in stored:
+            bind.execute(image.insert().values(
+                hash=image_hash, data=row.profile_picture_data,
+                mime_type=row.profile_picture_type or 'application/octet-stream',
+                size=len(row.profile_picture_data)))
+            stored.add(image_hash)
+        bind.execute(user.update().where(user.c.id == row.id).values(profile_picture_hash=image_hash))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_foreign_key('fk_user_profile_picture_hash', 'image', ['profile_picture_hash'], ['hash'])
+        batch_op.drop_column('profile_picture_data')
+        batch_op.drop_column('profile_picture_type')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_type', sa.VARCHAR(length=20), nullable=True))
+        batch_op.add_column(sa.Column('profile_picture_data', sa.BLOB(), nullable=True))
+
+    op.execute(
+        'UPDATE "user" SET '
+        'profile_picture_data = (SELECT data FROM image WHERE image.hash = "user".profile_picture_hash), '
+        'profile_picture_type = (SELECT mime_type FROM image WHERE image.hash = "user".profile_picture_hash)'
+    )
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_user_profile_picture_hash', type_='foreignkey')
+        batch_op.drop_column('profile_picture_hash')
@@ -1,18 +1,18 @@
-import base64
 import datetime
+from flask import url_for
 from extensions import db 
-from sqlalchemy import LargeBinary, event, update
+from sqlalchemy import LargeBinary, event, update, insert, select
+from sqlalchemy.orm import deferred, Session
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     first_name = db.Column(db.String(80), unique=False, nullable=True)
     last_name = db.Column(db.String(80), unique=False, nullable=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)
     email = db.Column(db.String(80), unique=True, nullable=False)
     status = db.Column(db.String(20), default='user')
-    profile_picture_data = db.Column(db.LargeBinary)
-    profile_picture_type = db.Column(db.String(20))
+    profile_picture_hash = db.Column(db.String(64), db.ForeignKey('image.hash'), nullable=True)
     reactions = db.relationship('Reaction', back_populates='user')
     comments = db.relationship('Comment', back_populates='user', cascade='all, delete-orphan')
 
@@ -22,27 +22,47 @@ class User(db.Model):
             "firstName": self.first_name,
             "lastName": self.last_name,
             "username": self.username,
-            "password": self.password,
             "email": self.email,
             "status": self.status,
             "profile_picture": self.get_profile_picture_url()
         }
     
     def get_profile_picture_url(self):
-        if self.profile_picture_data and self.profile_picture_type:
-            return f"data:{self.profile_picture_type};base64,{base64.b64encode(self.profile_picture_data).decode('utf-8')}"
-        return None
+        return image_url(self.profile_picture_hash)
 
     
 
+class Image(db.Model):
+    hash = db.Column(db.String(64), primary_key=True)
+    # the bytes are only read when an image is served or processed, use undefer(Image.data) there
+    data = deferred(db.Column(LargeBinary, nullable=False))
+    mime_type = db.Column(db.String(20), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+
+
+class ImageVariant(db.Model):
+    source_hash = db.Column(db.String(64), db.ForeignKey('image.hash'), primary_key=True)
+    variant = db.Column(db.String(10), primary_key=True)
+    image_hash = db.Column(db.String(64), db.ForeignKey('image.hash'), nullable=False)
+
+
+def image_url(image_hash):
+    if not image_hash:
+        return None
+    return url_for("images.get_image", image_hash=image_hash, _external=True)
+
+
+
 class Landmark(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(180), unique=False, nullable=False)
     description = db.Column(db.Text, unique=False, nullable=False)
-    image_data = db.Column(LargeBinary, nullable=False)
-    mime_type = db.Column(db.String(20), nullable=False)
+    image_hash = db.Column(db.String(64), db.ForeignKey('image.hash'), nullable=False)
     likes = db.Column(db.Integer, unique=False, nullable=False, default=0)
     dislikes = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    comment_count = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    # bumped whenever likes/dislikes are recounted from the reaction table, see counters.py
+    counter_generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     latitude = db.Column(db.Float, unique=False, nullable=False)
     longitude = db.Column(db.Float, unique=False, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -50,29 +70,89 @@ class Landmark(db.Model):
     user = db.relationship('User', backref=db.backref('landmarks', lazy=True))
     reactions = db.relationship('Reaction', back_populates='landmark')
 
+    image_variants = db.relationship(
+        'ImageVariant',
+        primaryjoin='foreign(ImageVariant.source_hash) == Landmark.image_hash',
+        viewonly=True,
+        lazy='selectin'
+    )
+
+    __table_args__ = (
+        db.Index('ix_landmark_lat_lon', 'latitude', 'longitude'),
+        db.Index('ix_landmark_user_id', 'user_id', 'id'),
+    )
+
+    def to_json(self, fields=None):
+        serializers = {
+            "id": lambda: self.id,
+            "name": lambda: self.name,
+            "description": lambda: self.description,
+            # cards are what the list view renders, the original is used until variants exist
+            "image": lambda: image_url(self.variant_hashes().get("card", self.image_hash)),
+            "images": lambda: {name: image_url(h) for name, h in self.variant_hashes().items()},
+            "likes": lambda: self.likes,
+            "dislikes": lambda: self.dislikes,
+            "latitude": lambda: self.latitude,
+            "longitude": lambda: self.longitude,
+            "user_id": lambda: self.user_id,
+            # the comments themselves are paged through GET /landmarks/<id>/comments
+            "comment_count": lambda: self.comment_count
+        }
+        return {name: serializers[name]() for name in (fields or serializers)}
+
+    def variant_hashes(self):
+        return {v.variant: v.image_hash for v in self.image_variants}
+
+
+# columns every to_json field reads, so list queries can load only what was asked for
+LANDMARK_FIELD_COLUMNS = {
+    "id": ("id",),
+    "name": ("name",),
+    "description": ("description",),
+    "image": ("image_hash",),
+    "images": ("image_hash",),
+    "likes": ("likes",),
+    "dislikes": ("dislikes",),
+    "latitude": ("latitude",),
+    "longitude": ("longitude",),
+    "user_id": ("user_id",),
+    "comment_count": ("comment_count",),
+}
+
+
+
+class LandmarkCluster(db.Model):
+    zoom = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cell_x = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cell_y = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    sum_lat = db.Column(db.Float, nullable=False, default=0)
+    sum_lon = db.Column(db.Float, nullable=False, default=0)
+    # no foreign key, the clustering listener repoints it after the landmark row is gone
+    representative_id = db.Column(db.Integer, nullable=True)
+
     def to_json(self):
         return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            "image": f"data:{self.mime_type};base64,{base64.b64encode(self.image_data).decode('utf-8')}",
-            "likes": self.likes,
-            "dislikes": self.dislikes,
-            "latitude": self.latitude,
-            "longitude": self.longitude,
-            "user_id": self.user_id,
-            "comments": [{
-                "id": comment.id,
-                "text": comment.text,
-                "likes": comment.likes,
-                "dislikes": comment.dislikes,
-                "date_of_creation": comment.date_of_creation.isoformat(),
-                "user_id": comment.user_id,
-                "username": comment.user.username,
-                "profile_picture": comment.user.get_profile_picture_url()
-            } for comment in self.comments]
+            "count": self.count,
+            "latitude": self.sum_lat / self.count,
+            "longitude": self.sum_lon / self.count,
+            "landmark_id": self.representative_id
         }
-    
+
+
+
+class LandmarkScore(db.Model):
+    landmark_id = db.Column(db.Integer, db.ForeignKey('landmark.id'), primary_key=True, autoincrement=False)
+    # lower bound of the wilson interval of likes / (likes + dislikes), see ranking.py
+    top = db.Column(db.Float, nullable=False, default=0)
+    # log of the reaction and comment activity decayed to ranking.TRENDING_EPOCH
+    trending = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_landmark_score_top', 'top', 'landmark_id'),
+        db.Index('ix_landmark_score_trending', 'trending', 'landmark_id'),
+    )
+
 
 
 class Comment(db.Model):
@@ -85,7 +165,15 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
     user = db.relationship('User', back_populates='comments')
-    landmark = db.relationship('Landmark', backref=db.backref('comments', lazy=True))
+    landmark = db.relationship(
+        'Landmark',
+        backref=db.backref('comments', lazy=True, order_by='Comment.date_of_creation.desc()')
+    )
+
+    __table_args__ = (
+        db.Index('ix_comment_landmark_date', 'landmark_id', 'date_of_creation'),
+        db.Index('ix_comment_user_id', 'user_id', 'id'),
+    )
 
     def to_json(self):
         return {
@@ -96,7 +184,8 @@ class Comment(db.Model):
             "date_of_creation": self.date_of_creation.isoformat(),
             "landmark_id": self.landmark_id,
             "user_id": self.user_id,
-            "username": self.user.username
+            "username": self.user.username,
+            "profile_picture": self.user.get_profile_picture_url()
         }
     
 
@@ -114,6 +203,7 @@ class Reaction(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('user_id', 'landmark_id', name='uq_user_landmark'),
+        db.Index('ix_reaction_landmark_id', 'landmark_id'),
     )
 
     def to_json(self):
@@ -126,44 +216,167 @@ class Reaction(db.Model):
     
 
 
-def increment_landmark_reaction(mapper, connection, target):
-    stmt = update(Landmark).where(Landmark.id == target.landmark_id)
-    if target.value == 'like':
-        stmt = stmt.values(likes=Landmark.likes + 1)
+class ResourceVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # queued -> running -> succeeded, or back to queued until max_attempts runs have failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    # at most one queued job per key (uq_job_queued_key), a running one may have one queued behind it, see jobs.enqueue
+    key = db.Column(db.String(100), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # a running job whose lease ran out belonged to a worker that died, it is claimed again
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_job_key', 'key', 'status'),
+        db.Index('uq_job_queued_key', 'key', unique=True,
+            sqlite_where=db.text("status = 'queued'"), postgresql_where=db.text("status = 'queued'")),
+    )
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_at": self.run_at.isoformat(),
+            "last_error": self.last_error,
+            "result": self.result,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+
+# reaction listeners only record deltas on the session, counters.py folds the committed
+# ones into landmark.likes/dislikes in batches instead of updating the row on every vote
+def stage_reaction_delta(target, value, sign):
+    session = db.inspect(target).session
+    deltas = session.info.setdefault("reaction_deltas", {})
+    likes, dislikes = deltas.get(target.landmark_id, (0, 0))
+    if value == 'like':
+        likes += sign
     else:
-        stmt = stmt.values(dislikes=Landmark.dislikes + 1)
-    connection.execute(stmt)
+        dislikes += sign
+    deltas[target.landmark_id] = (likes, dislikes)
+
+# the counter generation of every landmark a transaction voted on, read once the flush holds the
+# write lock so no recount can slip in between it and the commit
+def read_counter_generations(session, flush_context):
+    deltas = session.info.get("reaction_deltas")
+    if not deltas:
+        return
+    generations = session.info.setdefault("counter_generations", {})
+    missing = [landmark_id for landmark_id in deltas if landmark_id not in generations]
+    if missing:
+        generations.update(session.connection().execute(
+            select(Landmark.id, Landmark.counter_generation).where(Landmark.id.in_(missing))
+        ).all())
+
+# new votes and comments also count as activity for the trending feed, see ranking.py
+def stage_activity(target, reactions=0, comments=0):
+    session = db.inspect(target).session
+    activity = session.info.setdefault("landmark_activity", {})
+    staged = activity.get(target.landmark_id, (0, 0))
+    activity[target.landmark_id] = (staged[0] + reactions, staged[1] + comments)
+
+def increment_landmark_reaction(mapper, connection, target):
+    stage_reaction_delta(target, target.value, 1)
+    stage_activity(target, reactions=1)
 
 def decrement_landmark_reaction(mapper, connection, target):
-    stmt = update(Landmark).where(Landmark.id == target.landmark_id)
-    if target.value == 'like':
-        stmt = stmt.values(likes=Landmark.likes - 1)
-    else:
-        stmt = stmt.values(dislikes=Landmark.dislikes - 1)
-    connection.execute(stmt)
+    stage_reaction_delta(target, target.value, -1)
 
 def update_landmark_reaction(mapper, connection, target):
     hist = db.inspect(target).attrs.value.history
     if hist.deleted:
-        old_value = hist.deleted[0]
-        new_value = target.value
-        
-        stmt = update(Landmark).where(Landmark.id == target.landmark_id)
-        if old_value == 'like':
-            stmt = stmt.values(likes=Landmark.likes - 1)
-        else:
-            stmt = stmt.values(dislikes=Landmark.dislikes - 1)
-        connection.execute(stmt)
-        
-        stmt = update(Landmark).where(Landmark.id == target.landmark_id)
-        if new_value == 'like':
-            stmt = stmt.values(likes=Landmark.likes + 1)
-        else:
-            stmt = stmt.values(dislikes=Landmark.dislikes + 1)
-        connection.execute(stmt)
+        stage_reaction_delta(target, hist.deleted[0], -1)
+        stage_reaction_delta(target, target.value, 1)
+        stage_activity(target, reactions=1)
+
+def increment_landmark_comments(mapper, connection, target):
+    stmt = update(Landmark).where(Landmark.id == target.landmark_id)
+    connection.execute(stmt.values(comment_count=Landmark.comment_count + 1))
+    stage_activity(target, comments=1)
+
+def decrement_landmark_comments(mapper, connection, target):
+    stmt = update(Landmark).where(Landmark.id == target.landmark_id)
+    connection.execute(stmt.values(comment_count=Landmark.comment_count - 1))
+
+# which version counter (see conditional.py) a write to each model changes. Reactions are not in
+# here: every vote bumping the one "landmarks" row would serialize vote storms on it again, the
+# counter flush in counters.py bumps it once per batch instead. A vote only bumps its voter's own
+# "reactions:<user_id>" row, which views showing the caller's reactions depend on
+RESOURCE_OF_MODEL = {
+    Landmark: "landmarks",
+    Comment: "landmarks",
+    ImageVariant: "landmarks",
+    User: "users",
+}
+
+def bump_resource_versions(connection, resources):
+    for name in sorted(resources):
+        stmt = update(ResourceVersion).where(ResourceVersion.name == name)
+        result = connection.execute(stmt.values(version=ResourceVersion.version + 1))
+        if result.rowcount == 0:
+            connection.execute(insert(ResourceVersion).values(name=name, version=1))
+
+def mark_resource_changed(mapper, connection, target):
+    session = db.inspect(target).session
+    if session is not None:
+        session.info.setdefault("changed_resources", set()).add(RESOURCE_OF_MODEL[mapper.class_])
+
+def mark_user_reactions_changed(mapper, connection, target):
+    session = db.inspect(target).session
+    if session is not None:
+        session.info.setdefault("changed_resources", set()).add(f"reactions:{target.user_id}")
+
+def bump_changed_resources(session, flush_context):
+    resources = session.info.pop("changed_resources", None)
+    if resources:
+        bump_resource_versions(session.connection(), resources)
+        # kept until the transaction ends so after_commit hooks know what changed
+        session.info.setdefault("bumped_resources", set()).update(resources)
+
+def bump_on_bulk_write(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in RESOURCE_OF_MODEL:
+        resource = RESOURCE_OF_MODEL[mapper.class_]
+        bump_resource_versions(orm_execute_state.session.connection(), {resource})
+        orm_execute_state.session.info.setdefault("bumped_resources", set()).add(resource)
 
 event.listen(Reaction, 'after_insert', increment_landmark_reaction)
 event.listen(Reaction, 'before_delete', decrement_landmark_reaction)
 event.listen(Reaction, 'after_update', update_landmark_reaction)
+event.listen(Comment, 'after_insert', increment_landmark_comments)
+event.listen(Comment, 'before_delete', decrement_landmark_comments)
+
+for model in RESOURCE_OF_MODEL:
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, event_name, mark_resource_changed)
+for event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Reaction, event_name, mark_user_reactions_changed)
+event.listen(Session, 'after_flush', bump_changed_resources)
+event.listen(Session, 'after_flush', read_counter_generations)
+event.listen(Session, 'do_orm_execute', bump_on_bulk_write)
 
 print("[DEBUG] Event listeners registered!")
\ No newline at end of file
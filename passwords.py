@@ -0,0 +1,120 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# cost -> hash of nothing in particular, checked against for logins of unknown emails
+_dummy_hashes = {}
+
+
+def init_app(app):
+    # scrypt cost: n is the CPU/memory factor, r the block size, p the parallelism
+    app.config.setdefault("PASSWORD_SCRYPT_N", 2 ** 14)
+    app.config.setdefault("PASSWORD_SCRYPT_R", 8)
+    app.config.setdefault("PASSWORD_SCRYPT_P", 1)
+    # 0 hashes in the request thread instead of the process pool
+    app.config.setdefault("PASSWORD_HASH_WORKERS", os.cpu_count() or 1)
+
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r * p + 1024 * 1024, dklen=KEY_BYTES
+    )
+
+
+
+########################################################################## hash format: scrypt$n$r$p$salt$key (salt and key base64)
+def hash_password_sync(password, n, r, p):
+    salt = os.urandom(SALT_BYTES)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def verify_password_sync(password, stored):
+    # plain passwords from before hashing were hashed in place by migration 7c3e9a1f2b64
+    if not stored.startswith(SCHEME + "$"):
+        return False
+
+    try:
+        _, n, r, p, salt, key = stored.split("$")
+        expected = _unb64(key)
+        actual = _scrypt(password, _unb64(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+
+def _cost():
+    config = current_app.config
+    return config["PASSWORD_SCRYPT_N"], config["PASSWORD_SCRYPT_R"], config["PASSWORD_SCRYPT_P"]
+
+
+def _executor():
+    global _pool, _pool_pid
+    workers = current_app.config["PASSWORD_HASH_WORKERS"]
+    if not workers:
+        return None
+
+    # a pool inherited through fork has no live workers, every process creates its own
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run(fn, *args):
+    executor = _executor()
+    if executor is None:
+        return fn(*args)
+    # the request thread only waits here, the hashing itself runs outside this interpreter's GIL
+    return executor.submit(fn, *args).result()
+
+
+
+########################################################################## public helpers used by the auth routes
+def hash_password(password):
+    return _run(hash_password_sync, password, *_cost())
+
+
+def verify_password(password, stored):
+    if not stored:
+        return False
+    return _run(verify_password_sync, password, stored)
+
+
+########################################################################## takes as long as a real check and fails, so a login's timing does not tell whether the email exists
+def reject_password(password):
+    cost = _cost()
+    if cost not in _dummy_hashes:
+        _dummy_hashes[cost] = hash_password_sync(os.urandom(SALT_BYTES).hex(), *cost)
+    _run(verify_password_sync, password, _dummy_hashes[cost])
+    return False
+
+
+def needs_rehash(stored):
+    if not stored.startswith(SCHEME + "$"):
+        return True
+    try:
+        _, n, r, p, _, _ = stored.split("$")
+    except ValueError:
+        return True
+    return (int(n), int(r), int(p)) != _cost()
@@ -0,0 +1,164 @@
+import datetime
+import math
+import time
+from sqlalchemy import event, select, insert, update, delete, bindparam
+from extensions import db
+from models import Landmark, LandmarkScore, Comment
+
+# 95% confidence for the wilson lower bound of the like ratio
+WILSON_Z = 1.96
+
+# trending activity loses half its weight every TRENDING_HALF_LIFE seconds. The stored value is
+# log(sum of weight * e^((t - TRENDING_EPOCH) / tau)), which only changes when something happens,
+# yet orders landmarks exactly like the activity decayed to now would.
+TRENDING_HALF_LIFE = 24 * 3600
+TRENDING_TAU = TRENDING_HALF_LIFE / math.log(2)
+TRENDING_EPOCH = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+REACTION_WEIGHT = 1.0
+COMMENT_WEIGHT = 3.0
+# a new landmark starts out as if it had just been commented on
+NEW_LANDMARK_WEIGHT = COMMENT_WEIGHT
+
+FEEDS = {
+    "top": LandmarkScore.top,
+    "trending": LandmarkScore.trending,
+}
+
+
+########################################################################## lower bound of the wilson score interval of likes / (likes + dislikes)
+def wilson_score(likes, dislikes):
+    n = likes + dislikes
+    if n <= 0:
+        return 0.0
+    p = likes / n
+    z2 = WILSON_Z * WILSON_Z
+    centre = p + z2 / (2 * n)
+    margin = WILSON_Z * math.sqrt((p * (1 - p) + z2 / (4 * n)) / n)
+    return max(0.0, (centre - margin) / (1 + z2 / n))
+
+
+
+########################################################################## trending value of `weight` worth of activity at unix time `at`, and the sum of two of them
+def trending_value(weight, at):
+    return math.log(weight) + (at - TRENDING_EPOCH) / TRENDING_TAU
+
+def add_trending(a, b):
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+# what a stored trending value is worth right now, for clients
+def current_activity(trending, now=None):
+    return math.exp(trending - ((now or time.time()) - TRENDING_EPOCH) / TRENDING_TAU)
+
+
+
+########################################################################## folds a batch of counter changes into the scores, activity maps landmark id -> (reactions, comments)
+def update_scores(connection, landmark_ids, activity, now=None):
+    if not landmark_ids:
+        return 0
+    now = now or time.time()
+
+    # likes/dislikes were just updated in this transaction, the lock keeps other flushes out
+    rows = connection.execute(
+        select(LandmarkScore.landmark_id, LandmarkScore.trending, Landmark.likes, Landmark.dislikes)
+        .join(Landmark, Landmark.id == LandmarkScore.landmark_id)
+        .where(LandmarkScore.landmark_id.in_(landmark_ids))
+        .with_for_update()
+    ).all()
+
+    params = []
+    for landmark_id, trending, likes, dislikes in rows:
+        reactions, comments = activity.get(landmark_id, (0, 0))
+        weight = reactions * REACTION_WEIGHT + comments * COMMENT_WEIGHT
+        if weight > 0:
+            trending = add_trending(trending, trending_value(weight, now))
+        params.append({"score_id": landmark_id, "new_top": wilson_score(likes, dislikes), "new_trending": trending})
+
+    if params:
+        connection.execute(
+            update(LandmarkScore).where(LandmarkScore.landmark_id == bindparam("score_id"))
+            .values(top=bindparam("new_top"), trending=bindparam("new_trending")),
+            params
+        )
+    return len(params)
+
+
+
+########################################################################## recomputes the top score of every landmark, after likes/dislikes were corrected
+def refresh_top_scores(connection):
+    rows = connection.execute(
+        select(LandmarkScore.landmark_id, LandmarkScore.top, Landmark.likes, Landmark.dislikes)
+        .join(Landmark, Landmark.id == LandmarkScore.landmark_id)
+    ).all()
+    params = []
+    for landmark_id, top, likes, dislikes in rows:
+        score = wilson_score(likes, dislikes)
+        if score != top:
+            params.append({"score_id": landmark_id, "new_top": score})
+
+    if params:
+        connection.execute(
+            update(LandmarkScore).where(LandmarkScore.landmark_id == bindparam("score_id")).values(top=bindparam("new_top")),
+            params
+        )
+    return len(params)
+
+
+
+########################################################################## recomputes every score, trending from comment dates since reactions carry no timestamp
+def rebuild_scores(connection, now=None):
+    now = now or time.time()
+    trending = {}
+    comment_dates = connection.execute(
+        select(Comment.landmark_id, Comment.date_of_creation).execution_options(yield_per=1000)
+    )
+    for landmark_id, date_of_creation in comment_dates:
+        # comment dates are naive utc
+        at = date_of_creation.replace(tzinfo=datetime.timezone.utc).timestamp()
+        value = trending_value(COMMENT_WEIGHT, min(at, now))
+        trending[landmark_id] = add_trending(trending[landmark_id], value) if landmark_id in trending else value
+
+    # landmarks carry no creation date either, they are treated as created at the epoch
+    params = [
+        {"landmark_id": landmark_id, "top": wilson_score(likes, dislikes),
+         "trending": trending.get(landmark_id, trending_value(NEW_LANDMARK_WEIGHT, TRENDING_EPOCH))}
+        for landmark_id, likes, dislikes in connection.execute(select(Landmark.id, Landmark.likes, Landmark.dislikes))
+    ]
+    connection.execute(delete(LandmarkScore))
+    if params:
+        connection.execute(insert(LandmarkScore), params)
+    return len(params)
+
+
+
+########################################################################## one page of a feed, ordered by score with the id breaking ties, as (landmark_id, score) pairs
+def ranked_page(feed, limit, after=None):
+    column = FEEDS[feed]
+    stmt = select(LandmarkScore.landmark_id, column)
+    if after is not None:
+        score, landmark_id = after
+        stmt = stmt.where((column < score) | ((column == score) & (LandmarkScore.landmark_id < landmark_id)))
+
+    # walks ix_landmark_score_<feed> backwards, nothing is sorted at request time
+    return db.session.execute(stmt.order_by(column.desc(), LandmarkScore.landmark_id.desc()).limit(limit)).all()
+
+
+
+########################################################################## every landmark has a score row from the moment it exists
+def create_score(mapper, connection, target):
+    connection.execute(insert(LandmarkScore).values(
+        landmark_id=target.id,
+        top=wilson_score(target.likes or 0, target.dislikes or 0),
+        trending=trending_value(NEW_LANDMARK_WEIGHT, time.time())
+    ))
+
+def delete_score(mapper, connection, target):
+    connection.execute(delete(LandmarkScore).where(LandmarkScore.landmark_id == target.id))
+
+# bulk deletes skip the mapper listeners, deletion.py removes their rows with this
+def delete_scores(connection, landmark_ids):
+    connection.execute(delete(LandmarkScore).where(LandmarkScore.landmark_id.in_(landmark_ids)))
+
+event.listen(Landmark, 'after_insert', create_score)
+event.listen(Landmark, 'before_delete', delete_score)
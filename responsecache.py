@@ -0,0 +1,91 @@
+import logging
+from flask import request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+from cache import TTLCache
+from conditional import resource_versions
+import jobs
+
+logger = logging.getLogger(__name__)
+
+# pre-encoded response bodies, replaced by init_app with the configured backend
+_backend = TTLCache(maxsize=1024, ttl=300)
+
+
+def init_app(app):
+    global _backend
+    app.config.setdefault("RESPONSE_CACHE_SIZE", 1024)
+    app.config.setdefault("RESPONSE_CACHE_TTL", 300)
+    # "module:Class" of a shared store (redis, memcached, ...) with the get/set/clear of cache.TTLCache
+    app.config.setdefault("RESPONSE_CACHE_BACKEND", None)
+    # pages a job renders again after a write emptied the cache, so readers do not all miss at once
+    app.config.setdefault("RESPONSE_CACHE_WARM_PATHS", ["/landmarks"])
+    app.config.setdefault("RESPONSE_CACHE_WARM_DELAY", 1.0)
+
+    backend_class = TTLCache
+    if app.config["RESPONSE_CACHE_BACKEND"]:
+        backend_class = import_string(app.config["RESPONSE_CACHE_BACKEND"])
+    _backend = backend_class(maxsize=app.config["RESPONSE_CACHE_SIZE"], ttl=app.config["RESPONSE_CACHE_TTL"])
+
+
+
+########################################################################## key for the current request: host, path, sorted query string, negotiated type and resource versions
+def cache_key(*resources):
+    args = "&".join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+    versions = ",".join(f"{name}:{version}" for name, version in zip(resources, resource_versions(resources)))
+    accept = request.accept_mimetypes.best or ""
+    # the versions change on every write of any worker, so an entry can never outlive its data
+    # bodies hold absolute image urls, built for the scheme and host the request came in on
+    return f"{request.host_url}{request.path.lstrip('/')}?{args}|{accept}|{versions}"
+
+
+def get(key):
+    return _backend.get(key)
+
+
+def put(key, value):
+    _backend.set(key, value)
+
+
+def clear():
+    _backend.clear()
+
+
+
+########################################################################## drops everything once a local transaction changed landmarks, comments or reactions
+def clear_on_commit(session):
+    resources = session.info.pop("bumped_resources", None)
+    if resources and "landmarks" in resources:
+        clear()
+        schedule_warmup()
+
+def forget_on_rollback(session):
+    session.info.pop("bumped_resources", None)
+
+event.listen(Session, 'after_commit', clear_on_commit)
+event.listen(Session, 'after_rollback', forget_on_rollback)
+
+
+
+########################################################################## queues a job that requests the warm paths again, one queued job covers any number of writes
+def schedule_warmup():
+    paths = current_app.config["RESPONSE_CACHE_WARM_PATHS"]
+    if not paths or not has_request_context() or not jobs.workers_enabled():
+        return
+    try:
+        # rendered for the host of the request that changed the data, the image urls in the body depend on it
+        jobs.enqueue_detached(
+            "warm_cache", {"base_url": request.host_url, "paths": paths},
+            key="warm_cache", delay=current_app.config["RESPONSE_CACHE_WARM_DELAY"]
+        )
+    except Exception:
+        # the write itself is already committed, a cold cache is all this costs
+        logger.exception("Could not queue cache warming")
+
+
+@jobs.handler("warm_cache")
+def warm_cache_job(payload):
+    # with the in-process backend only the worker's own process gets warm, a shared backend warms every one
+    client = current_app.test_client()
+    return {path: client.get(path, base_url=payload["base_url"]).status_code for path in payload["paths"]}
@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from decorators import admin_required
 from extensions import db
-from models import User, Landmark, Comment, Reaction
+from models import User, Landmark, Comment
+from images import schedule_prune
+from deletion import DELETE_INLINE_LIMIT, landmark_rows, user_rows, delete_landmarks, delete_user_everything
+import jobs
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -35,15 +38,17 @@ def delete_landmark(user_id):
     try:
         data = request.get_json()
         landmark_id = data.get("landmark_id")
-        landmark = Landmark.query.get(landmark_id)
-        if not landmark:
+        exists = db.session.query(Landmark.id).filter_by(id=landmark_id).first()
+        if not exists:
             return jsonify({"message": "Landmark not found"}), 404
 
-        Reaction.query.filter_by(landmark_id=landmark_id).delete()
+        # a landmark with a huge discussion is removed by a job, the caller polls GET /jobs/<job_id>
+        if landmark_rows([landmark_id]) > DELETE_INLINE_LIMIT:
+            job = jobs.enqueue("delete_landmark", {"landmark_id": landmark_id}, key=f"delete_landmark:{landmark_id}", user_id=user_id)
+            db.session.commit()
+            return jsonify({"message": "Landmark deletion queued", "job_id": job.id}), 202
 
-        Comment.query.filter_by(landmark_id=landmark_id).delete()
-
-        db.session.delete(landmark)
+        schedule_prune(delete_landmarks([landmark_id]))
         db.session.commit()
 
         return jsonify({"message": "Landmark and all related data deleted"}), 200
@@ -62,27 +67,20 @@ def delete_user(user_id):
         if deleted_user_id == user_id:
             return jsonify({"message": "Admins cannot delete themselves"}), 403
 
-        user = User.query.get(deleted_user_id)
-        if not user:
+        exists = db.session.query(User.id).filter_by(id=deleted_user_id).first()
+        if not exists:
             return jsonify({"message": "User not found"}), 404
 
-        for reaction in user.reactions:
-            db.session.delete(reaction)
-
-        Comment.query.filter_by(user_id=user_id).delete()
-        
+        # a heavy account is removed by a job in chunks, the caller polls GET /jobs/<job_id> for progress
+        if user_rows(deleted_user_id) > DELETE_INLINE_LIMIT:
+            job = jobs.enqueue("delete_user", {"user_id": deleted_user_id}, key=f"delete_user:{deleted_user_id}", user_id=user_id)
+            db.session.commit()
+            return jsonify({"message": "User deletion queued", "job_id": job.id}), 202
 
-        for landmark in user.landmarks:
-            for reaction in landmark.reactions:
-                db.session.delete(reaction)
-            Comment.query.filter_by(landmark_id=landmark.id).delete()
-            db.session.delete(landmark)
-
-        db.session.delete(user)
-        db.session.commit()
+        delete_user_everything(deleted_user_id)
 
         return jsonify({"message": "User and all related data deleted"}), 200
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({"message": f"Error deleting user: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"message": f"Error deleting user: {str(e)}"}), 500
@@ -1,8 +1,12 @@
 from flask import Blueprint, make_response, request, jsonify, current_app
-from decorators import admin_required
+from decorators import admin_required, token_required, decode_token, read_replica
+from conditional import conditional
+from passwords import hash_password, verify_password, reject_password, needs_rehash
 import jwt
 from extensions import db
-from models import User, Landmark
+from models import User
+from serializers import user_serializer
+from streaming import stream_format, stream_rows, json_array_response, ndjson_response
 import datetime
 from datetime import timedelta, timezone
 
@@ -11,11 +15,19 @@ auth_bp = Blueprint('auth', __name__)
 
 ########################################################################## get all users endpoint
 @auth_bp.route("/users", methods=["GET"])
+@read_replica
 @admin_required
+@conditional("users")
 def get_users(user_id):
-    users = User.query.all()
-    json_users = list(map(lambda x: x.to_json(), users))
-    return jsonify({"users": json_users})
+    stmt, serialize = user_serializer()
+
+    mode = stream_format()
+    if mode == "ndjson":
+        return ndjson_response(stream_rows(stmt.order_by(User.id), serialize))
+    if mode == "json":
+        return json_array_response("users", stream_rows(stmt.order_by(User.id), serialize))
+
+    return jsonify({"users": serialize(db.session.execute(stmt).all())})
 
 
 
@@ -35,7 +47,7 @@ def register():
     if not username or not password or not email:
         return jsonify({"message": "Some data is missing!"}), 400
     
-    new_user = User(username=username, password=password, email=email)
+    new_user = User(username=username, password=hash_password(password), email=email)
     try:
         db.session.add(new_user)
         db.session.commit()
@@ -57,14 +69,25 @@ def login():
         return jsonify({"message": "Missing email or password"}), 400
 
     user = User.query.filter_by(email=email).first()
-    if not user or password != user.password:
+    if not user:
+        reject_password(password)
+        return jsonify({"message": "Invalid credentials"}), 401
+    if not verify_password(password, user.password):
         return jsonify({"message": "Invalid credentials"}), 401
 
+    # upgrades hashes made with older cost settings
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.session.commit()
+
     expiration_time = datetime.datetime.now(timezone.utc) + datetime.timedelta(hours=1)
 
     token = jwt.encode(
         {
             "user_id": user.id,
+            # lets /check_auth answer from the token alone
+            "username": user.username,
+            "status": user.status or "user",
             "exp": expiration_time,
             "iat": datetime.datetime.now(timezone.utc)
         },
@@ -87,19 +110,16 @@ def logout():
 
 
 
-########################################################################## endpoint that checks whether user is authenticated
+########################################################################## endpoint that checks whether user is authenticated, answered from the token claims
 @auth_bp.route("/check_auth", methods=["GET"])
+@read_replica
 def check_auth():
     token = request.cookies.get("access_token")
     if not token:
         return jsonify({"loggedIn": False}), 200
 
     try:
-        data = jwt.decode(
-            token,
-            current_app.config["SECRET_KEY"],
-            algorithms=["HS256"]
-        )
+        data = decode_token(token)
         exp = datetime.datetime.fromtimestamp(data['exp'], tz=timezone.utc)
         iat = datetime.datetime.fromtimestamp(data['iat'], tz=timezone.utc)
 
@@ -109,24 +129,21 @@ def check_auth():
             return response
 
         user_id = data["user_id"]
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({"message": "User not found!"}), 404
+        username, status = data.get("username"), data.get("status")
 
-        user_landmarks = Landmark.query.filter_by(user_id=user_id).all()
-        json_user_landmarks = list(map(lambda x: x.to_json(), user_landmarks))
+        # tokens issued before the claims were added need one small lookup
+        if username is None:
+            user = db.session.query(User.username, User.status).filter_by(id=user_id).first()
+            if not user:
+                return jsonify({"message": "User not found!"}), 404
+            username, status = user.username, user.status or "user"
 
+        # profile and owned landmarks are served by /me and /me/landmarks
         return jsonify({
             "loggedIn": True,
-            "user_id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "firstName": user.first_name,
-            "lastName": user.last_name,
-            "status": user.status,
-            "profile_picture": user.get_profile_picture_url(),
-            "user_landmarks": json_user_landmarks
+            "user_id": user_id,
+            "username": username,
+            "status": status
         })
 
     except jwt.ExpiredSignatureError:
@@ -135,3 +152,17 @@ def check_auth():
         return response
     except jwt.InvalidTokenError:
         return jsonify({"loggedIn": False, "message": "Invalid token!"}), 401
+
+
+
+########################################################################## profile of the logged in user
+@auth_bp.route("/me", methods=["GET"])
+@read_replica
+@token_required
+@conditional("users")
+def get_me(user_id):
+    user = db.session.get(User, user_id)
+    if not user:
+        return jsonify({"message": "User not found!"}), 404
+
+    return jsonify(user.to_json())
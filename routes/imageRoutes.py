@@ -0,0 +1,35 @@
+from flask import Blueprint, request, jsonify, make_response
+from extensions import db
+from models import Image
+from sqlalchemy.orm import undefer
+import re
+
+images_bp = Blueprint('images', __name__)
+
+IMAGE_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# the url changes whenever the bytes do, so clients may keep the image forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+########################################################################## serve raw image bytes by content hash
+@images_bp.route("/images/<image_hash>", methods=["GET"])
+def get_image(image_hash):
+    if not IMAGE_HASH_RE.match(image_hash):
+        return jsonify({"message": "Image not found"}), 404
+
+    if request.if_none_match.contains(image_hash):
+        response = make_response("", 304)
+        response.set_etag(image_hash)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    image = db.session.get(Image, image_hash, options=[undefer(Image.data)])
+    if not image:
+        return jsonify({"message": "Image not found"}), 404
+
+    response = make_response(image.data)
+    response.mimetype = image.mime_type
+    response.set_etag(image_hash)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,75 @@
+from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
+from decorators import token_required, admin_required, get_user_status
+from extensions import db
+from models import Job
+import jobs
+
+jobs_bp = Blueprint('jobs', __name__)
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+########################################################################## status of one job, for the user who queued it and for admins
+@jobs_bp.route("/jobs/<int:job_id>", methods=["GET"])
+@token_required
+def get_job(user_id, job_id):
+    job = db.session.get(Job, job_id)
+    # someone else's job looks exactly like a missing one
+    if not job or (job.user_id != user_id and get_user_status(user_id) != 'admin'):
+        return jsonify({"message": "Job not found"}), 404
+
+    return jsonify(job.to_json())
+
+
+
+########################################################################## newest jobs first, ?status= and ?kind= narrow it down, ?cursor= is the id the previous page ended with
+@jobs_bp.route("/jobs", methods=["GET"])
+@admin_required
+def get_jobs(user_id):
+    status = request.args.get("status")
+    if status is not None and status not in JOB_STATUSES:
+        return jsonify({"message": "Invalid status"}), 400
+    limit = max(1, min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    cursor = request.args.get("cursor", type=int)
+
+    query = Job.query
+    if status:
+        query = query.filter(Job.status == status)
+    if request.args.get("kind"):
+        query = query.filter(Job.kind == request.args["kind"])
+    if cursor is not None:
+        query = query.filter(Job.id < cursor)
+
+    found = query.order_by(Job.id.desc()).limit(limit + 1).all()
+    has_more = len(found) > limit
+    found = found[:limit]
+
+    return jsonify({
+        "jobs": [job.to_json() for job in found],
+        "next_cursor": found[-1].id if has_more else None
+    })
+
+
+
+########################################################################## gives a failed job a fresh set of attempts
+@jobs_bp.route("/jobs/<int:job_id>/retry", methods=["POST"])
+@admin_required
+def retry_job(user_id, job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+    if job.status != 'failed':
+        return jsonify({"message": "Only failed jobs can be retried"}), 409
+
+    # a job queued under the same key in the meantime is returned instead
+    job = jobs.requeue(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A job with the same key was queued meanwhile"}), 409
+
+    return jsonify(job.to_json()), 202
@@ -1,9 +1,23 @@
 from flask import Blueprint, request, jsonify, current_app
-from decorators import token_optional, token_required
+from decorators import token_optional, token_required, read_replica
 from extensions import db
 from config import ALLOWED_EXTENSIONS
-from models import Landmark, Comment, Reaction
+from models import Landmark, Comment, Reaction, LANDMARK_FIELD_COLUMNS
+from sqlalchemy import and_, or_
+from images import store_image, schedule_variants
+from spatial import nearest_in_bbox, nearest_within
+from conditional import conditional, USER_REACTIONS
+from clustering import MAX_CLUSTER_ZOOM, clusters_in_bbox
+from search import search
+from ranking import ranked_page, current_activity
+import responsecache
+from serializers import landmark_serializer, comment_serializer
+from streaming import stream_format, stream_rows, json_array_response, ndjson_response
+from metrics import timed_serialization
+import base64
 import datetime
+import math
+import time
 
 landmarks_bp = Blueprint('landmarks', __name__)
 
@@ -14,23 +28,329 @@ def allowed_file(filename):
 
 
 
-########################################################################## get all landmarks endpoint
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+########################################################################## reads ?limit= and ?cursor= (the id the previous page ended with)
+def parse_page_args():
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get("cursor", type=int)
+    if "cursor" in request.args and cursor is None:
+        raise ValueError("Invalid cursor")
+    return max(1, min(limit, MAX_PAGE_SIZE)), cursor
+
+
+
+########################################################################## reads ?fields=id,name,... and checks it against what to_json can produce
+def parse_landmark_fields():
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in LANDMARK_FIELD_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return fields
+
+
+
+########################################################################## reads a comma separated list of exactly `count` numbers
+def parse_floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
+    if len(numbers) != count or not all(map(math.isfinite, numbers)):
+        raise ValueError(f"Invalid {name}")
+    return numbers
+
+
+
+########################################################################## reads ?bbox=min_lon,min_lat,max_lon,max_lat
+def parse_bbox():
+    min_lon, min_lat, max_lon, max_lat = parse_floats(request.args.get("bbox", ""), 4, "bbox")
+    if not -90 <= min_lat <= max_lat <= 90 or not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("Invalid bbox")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+
+########################################################################## json bytes exactly as jsonify would send them
+def encode_json(value):
+    with timed_serialization():
+        return current_app.json.dumpb(value)
+
+
+
+########################################################################## the user's reactions on the given landmarks
+def user_interactions(user_id, landmark_ids):
+    if not user_id or not landmark_ids:
+        return {}
+
+    return dict(db.session.query(Reaction.landmark_id, Reaction.value).filter(
+        Reaction.user_id == user_id,
+        Reaction.landmark_id.in_(landmark_ids)
+    ).all())
+
+
+
+########################################################################## get landmarks endpoint, one page at a time ordered by id
 @landmarks_bp.route("/landmarks", methods=["GET"])
+@read_replica
 @token_optional
+@conditional("landmarks", USER_REACTIONS)
 def get_landmarks(user_id):
-    landmarks = Landmark.query.all()
-    
+    try:
+        limit, cursor = parse_page_args()
+        fields = parse_landmark_fields()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    mode = stream_format()
+    if mode is not None:
+        return stream_landmarks(user_id, fields, cursor, mode)
+
+    key = responsecache.cache_key("landmarks")
+    entry = responsecache.get(key)
+    if entry is None:
+        stmt, serialize = landmark_serializer(fields)
+        if cursor is not None:
+            stmt = stmt.where(Landmark.id > cursor)
+
+        # one extra row tells us whether there is a next page
+        rows = db.session.execute(stmt.order_by(Landmark.id).limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        landmarks = serialize(rows[:limit])
+
+        body = encode_json({
+            "landmarks": landmarks,
+            "next_cursor": landmarks[-1]["id"] if has_more else None
+        })
+        # everything but the closing brace, the interactions are appended per request
+        entry = (body[:-1], [landmark["id"] for landmark in landmarks])
+        responsecache.put(key, entry)
+
+    body, landmark_ids = entry
+    interactions = encode_json(user_interactions(user_id, landmark_ids))
+    return current_app.response_class(
+        body + b',"interactions":' + interactions + b'}',
+        mimetype=current_app.json.mimetype
+    )
+
+
+
+########################################################################## every landmark after the cursor, ?stream=json keeps the paged shape, ?stream=ndjson is one landmark per line
+def stream_landmarks(user_id, fields, cursor, mode):
+    stmt, serialize = landmark_serializer(fields)
+    if cursor is not None:
+        stmt = stmt.where(Landmark.id > cursor)
+
     interactions = {}
-    if user_id:
-        user_reactions = Reaction.query.filter_by(user_id=user_id).all()
-        interactions = {reaction.landmark_id: reaction.value for reaction in user_reactions}
 
-    for landmark in landmarks:
-        landmark.comments.sort(key=lambda c: c.date_of_creation, reverse=True)
-    
+    def with_interactions(chunks):
+        for landmarks in chunks:
+            chunk_interactions = user_interactions(user_id, [landmark["id"] for landmark in landmarks])
+            if mode == "ndjson":
+                # lines stand on their own, so the user's reaction goes on the landmark itself
+                for landmark in landmarks:
+                    if landmark["id"] in chunk_interactions:
+                        landmark["interaction"] = chunk_interactions[landmark["id"]]
+            else:
+                interactions.update(chunk_interactions)
+            yield landmarks
+
+    chunks = with_interactions(stream_rows(stmt.order_by(Landmark.id), serialize))
+    if mode == "ndjson":
+        return ndjson_response(chunks)
+    return json_array_response("landmarks", chunks, lambda: {"interactions": interactions, "next_cursor": None})
+
+
+
+########################################################################## landmarks owned by the logged in user, paged like /landmarks
+@landmarks_bp.route("/me/landmarks", methods=["GET"])
+@read_replica
+@token_required
+@conditional("landmarks")
+def get_my_landmarks(user_id):
+    try:
+        limit, cursor = parse_page_args()
+        fields = parse_landmark_fields()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    stmt, serialize = landmark_serializer(fields)
+    stmt = stmt.where(Landmark.user_id == user_id)
+    if cursor is not None:
+        stmt = stmt.where(Landmark.id > cursor)
+
+    rows = db.session.execute(stmt.order_by(Landmark.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    landmarks = serialize(rows[:limit])
+
+    return jsonify({
+        "landmarks": landmarks,
+        "next_cursor": landmarks[-1]["id"] if has_more else None
+    })
+
+
+
+########################################################################## landmarks inside ?bbox=min_lon,min_lat,max_lon,max_lat or ?near=lat,lon&radius=meters
+@landmarks_bp.route("/landmarks/within", methods=["GET"])
+@read_replica
+@token_optional
+@conditional("landmarks", USER_REACTIONS)
+def get_landmarks_within(user_id):
+    try:
+        limit, _ = parse_page_args()
+        fields = parse_landmark_fields()
+
+        if "bbox" in request.args:
+            min_lon, min_lat, max_lon, max_lat = parse_bbox()
+
+            # distances are measured from the middle of the box, which may straddle the antimeridian
+            center_lon = (min_lon + max_lon + (360 if min_lon > max_lon else 0)) / 2
+            center_lon = center_lon - 360 if center_lon > 180 else center_lon
+            matches = nearest_in_bbox(min_lat, min_lon, max_lat, max_lon, (min_lat + max_lat) / 2, center_lon, limit)
+
+        elif "near" in request.args:
+            lat, lon = parse_floats(request.args["near"], 2, "near")
+            radius = request.args.get("radius", type=float)
+            if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+                raise ValueError("Invalid near")
+            if radius is None or not 0 < radius < math.inf:
+                raise ValueError("Invalid radius")
+            matches = nearest_within(lat, lon, radius, limit)
+
+        else:
+            return jsonify({"message": "Either bbox or near is required"}), 400
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    distances = dict(matches)
+    landmarks = []
+    if distances:
+        stmt, serialize = landmark_serializer(fields)
+        landmarks = serialize(db.session.execute(stmt.where(Landmark.id.in_(distances))).all())
+        for landmark in landmarks:
+            landmark["distance"] = round(distances[landmark["id"]], 1)
+        landmarks.sort(key=lambda landmark: distances[landmark["id"]])
+
+    return jsonify({
+        "landmarks": landmarks,
+        "interactions": user_interactions(user_id, list(distances))
+    })
+
+
+
+########################################################################## full text search over landmark names, descriptions and comments, ?q=...&limit=...&cursor=...
+# ?prefix=1 lets the last word match as a prefix, for search as you type
+@landmarks_bp.route("/search", methods=["GET"])
+@read_replica
+@conditional("landmarks")
+def search_landmarks():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"message": "q is required"}), 400
+
+    try:
+        limit, offset = parse_page_args()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    offset = max(offset or 0, 0)
+
+    # the cursor is the offset of the next page in the ranking
+    results, has_more = search(q, limit, offset, prefix=request.args.get("prefix") == "1")
+
     return jsonify({
-        "landmarks": [landmark.to_json() for landmark in landmarks],
-        "interactions": interactions
+        "results": results,
+        "next_cursor": offset + limit if has_more else None
+    })
+
+
+
+########################################################################## feed cursors are opaque to clients, inside they are "<score>|<id>" of the last landmark sent
+def encode_score_cursor(score, landmark_id):
+    raw = f"{score!r}|{landmark_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_score_cursor(cursor):
+    try:
+        score, landmark_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        score = float(score)
+        if not math.isfinite(score):
+            raise ValueError("Invalid cursor")
+        return score, int(landmark_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+
+########################################################################## landmarks ranked by their wilson score (top) or by recent reactions and comments (trending)
+@landmarks_bp.route("/landmarks/top", methods=["GET"], defaults={"feed": "top"})
+@landmarks_bp.route("/landmarks/trending", methods=["GET"], defaults={"feed": "trending"})
+@read_replica
+@token_optional
+@conditional("landmarks", USER_REACTIONS)
+def get_ranked_landmarks(user_id, feed):
+    try:
+        limit = max(1, min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        fields = parse_landmark_fields()
+        after = decode_score_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # the order comes from the score table alone, the page is then loaded by id
+    ranked = ranked_page(feed, limit + 1, after)
+    has_more = len(ranked) > limit
+    ranked = ranked[:limit]
+
+    landmarks = []
+    if ranked:
+        stmt, serialize = landmark_serializer(fields)
+        by_id = {landmark["id"]: landmark for landmark in serialize(db.session.execute(
+            stmt.where(Landmark.id.in_([landmark_id for landmark_id, _ in ranked]))
+        ).all())}
+        now = time.time()
+        for landmark_id, score in ranked:
+            # trending values are stored relative to a fixed epoch, clients get the activity as of now
+            if landmark_id in by_id:
+                by_id[landmark_id]["score"] = score if feed == "top" else round(current_activity(score, now), 3)
+                landmarks.append(by_id[landmark_id])
+
+    return jsonify({
+        "landmarks": landmarks,
+        "interactions": user_interactions(user_id, [landmark["id"] for landmark in landmarks]),
+        "next_cursor": encode_score_cursor(ranked[-1][1], ranked[-1][0]) if has_more else None
+    })
+
+
+
+########################################################################## pre-aggregated map clusters for ?bbox=...&zoom=
+@landmarks_bp.route("/landmarks/clusters", methods=["GET"])
+@read_replica
+@conditional("landmarks")
+def get_landmark_clusters():
+    zoom = request.args.get("zoom", type=int)
+    if zoom is None or zoom < 0:
+        return jsonify({"message": "Invalid zoom"}), 400
+
+    # past the deepest level the grid cells hold only a handful of landmarks, the client can fetch them directly
+    zoom = min(zoom, MAX_CLUSTER_ZOOM)
+
+    try:
+        min_lon, min_lat, max_lon, max_lat = parse_bbox()
+        clusters = clusters_in_bbox(min_lat, min_lon, max_lat, max_lon, zoom)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({
+        "zoom": zoom,
+        "clusters": [cluster.to_json() for cluster in clusters]
     })
 
 
@@ -45,13 +365,13 @@ def create_landmark():
     if file.filename == "" or not allowed_file(file.filename):
         return jsonify({"message": "Invalid image file"}), 400
 
-    # Read image data and store in database
+    # Read image data, it is stored once per distinct content
     image_data = file.read()
     mime_type = file.mimetype
 
     name = request.form.get("name")
     description = request.form.get("description")
-    likes = request.form.get("likes", 0)
+    likes = request.form.get("likes", 0, type=int)
     latitude = request.form.get("latitude")
     longitude = request.form.get("longitude")
     user_id = request.form.get("user_id")
@@ -62,8 +382,6 @@ def create_landmark():
     landmark = Landmark(
         name=name,
         description=description,
-        image_data=image_data,
-        mime_type=mime_type,
         likes=likes,
         latitude=latitude,
         longitude=longitude,
@@ -71,7 +389,10 @@ def create_landmark():
     )
 
     try:
+        landmark.image_hash = store_image(image_data, mime_type)
         db.session.add(landmark)
+        # thumbnails and cards are rendered by a job worker, the list view shows the original until then
+        schedule_variants(landmark.image_hash)
         db.session.commit()
         return jsonify(landmark.to_json()), 201
     except Exception as e:
@@ -80,6 +401,56 @@ def create_landmark():
 
 
 
+########################################################################## comment cursors are opaque to clients, inside they are "<date_of_creation>|<id>"
+def encode_comment_cursor(date_of_creation, comment_id):
+    raw = f"{date_of_creation.isoformat()}|{comment_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_comment_cursor(cursor):
+    try:
+        date, comment_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(date), int(comment_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+
+########################################################################## comments of one landmark, newest first, one page at a time
+@landmarks_bp.route("/landmarks/<int:landmark_id>/comments", methods=["GET"])
+@read_replica
+@conditional("landmarks", "users")
+def get_landmark_comments(landmark_id):
+    limit = max(1, min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+    exists = db.session.query(Landmark.id).filter_by(id=landmark_id).first()
+    if not exists:
+        return jsonify({"error": "Landmark not found"}), 404
+
+    # walks ix_comment_landmark_date backwards, id breaks ties between equal timestamps
+    stmt, serialize = comment_serializer()
+    stmt = stmt.where(Comment.landmark_id == landmark_id)
+    if request.args.get("cursor"):
+        try:
+            date, comment_id = decode_comment_cursor(request.args["cursor"])
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        stmt = stmt.where(or_(
+            Comment.date_of_creation < date,
+            and_(Comment.date_of_creation == date, Comment.id < comment_id)
+        ))
+
+    rows = db.session.execute(stmt.order_by(Comment.date_of_creation.desc(), Comment.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        "comments": serialize(rows),
+        "next_cursor": encode_comment_cursor(rows[-1].date_of_creation, rows[-1].id) if has_more else None
+    })
+
+
+
 ########################################################################## create new comment endpoint
 @landmarks_bp.route('/comment', methods=['POST'])
 @token_required
@@ -127,7 +498,6 @@ def handle_reaction(user_id):
     try:
 
         if reaction_value is None:
-            existing = Reaction.query.filter_by(user_id=user_id, landmark_id=landmark_id).first()
             if existing:
                 db.session.delete(existing)
                 db.session.commit()
@@ -158,9 +528,88 @@ def handle_reaction(user_id):
         return jsonify({"message": str(e)}), 500
 
 
+
+MAX_BATCH_REACTIONS = 500
+
+
+########################################################################## many like/dislike changes in one request and one transaction
+@landmarks_bp.route('/reactions/batch', methods=['POST'])
+@token_required
+def handle_reactions_batch(user_id):
+    data = request.get_json(silent=True) or {}
+    items = data.get("reactions") if isinstance(data, dict) else None
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"message": "reactions must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_REACTIONS:
+        return jsonify({"message": f"At most {MAX_BATCH_REACTIONS} reactions per request"}), 400
+
+    # when a landmark shows up more than once the last item wins, like it would with single calls
+    results = [None] * len(items)
+    wanted = {}
+    for index, item in enumerate(items):
+        landmark_id = item.get("landmark_id") if isinstance(item, dict) else None
+        reaction_value = item.get("reaction") if isinstance(item, dict) else None
+
+        if not isinstance(landmark_id, int) or isinstance(landmark_id, bool):
+            results[index] = {"landmark_id": landmark_id, "status": "error", "message": "Invalid landmark_id"}
+        elif reaction_value not in ['like', 'dislike', None]:
+            results[index] = {"landmark_id": landmark_id, "status": "error", "message": "Invalid reaction type"}
+        else:
+            if landmark_id in wanted:
+                superseded = wanted[landmark_id][0]
+                results[superseded] = {"landmark_id": landmark_id, "status": "superseded"}
+            wanted[landmark_id] = (index, reaction_value)
+
+    try:
+        existing_landmarks = {
+            row.id for row in db.session.query(Landmark.id).filter(Landmark.id.in_(wanted))
+        } if wanted else set()
+        existing_reactions = {
+            reaction.landmark_id: reaction for reaction in Reaction.query.filter(
+                Reaction.user_id == user_id,
+                Reaction.landmark_id.in_(wanted)
+            )
+        } if wanted else {}
+
+        for landmark_id, (index, reaction_value) in wanted.items():
+            existing = existing_reactions.get(landmark_id)
+
+            if landmark_id not in existing_landmarks:
+                status = "not_found"
+            elif reaction_value is None:
+                status = "removed" if existing else "unchanged"
+                if existing:
+                    db.session.delete(existing)
+            elif existing is None:
+                status = "created"
+                db.session.add(Reaction(user_id=user_id, landmark_id=landmark_id, value=reaction_value))
+            elif existing.value != reaction_value:
+                status = "updated"
+                existing.value = reaction_value
+            else:
+                status = "unchanged"
+
+            results[index] = {
+                "landmark_id": landmark_id,
+                "status": status,
+                "current_reaction": reaction_value if status != "not_found" else None
+            }
+
+        # the counter listeners sum up every change per landmark, see stage_reaction_delta
+        db.session.commit()
+        return jsonify({"results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 500
+
+
 ########################################################################## endpoint to get user's reaction on a specific landmark
 @landmarks_bp.route("/interacted", methods=["GET"])
+@read_replica
 @token_required
+@conditional("landmarks", USER_REACTIONS)
 def interacted(user_id):
 
     data = request.get_json()
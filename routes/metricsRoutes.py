@@ -0,0 +1,21 @@
+from flask import Blueprint, request, jsonify, current_app
+import hmac
+import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+########################################################################## request, database and serialization metrics of every process, for prometheus to scrape
+@metrics_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            return jsonify({"message": "Invalid metrics token"}), 401
+    elif not (current_app.config["METRICS_PUBLIC"] or current_app.debug or current_app.testing):
+        return jsonify({"message": "Metrics need METRICS_TOKEN (or METRICS_PUBLIC=1)"}), 403
+
+    return current_app.response_class(metrics.render(metrics.collect()), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -3,6 +3,7 @@ from decorators import token_required
 from config import ALLOWED_EXTENSIONS
 from extensions import db
 from models import User
+from images import store_image, schedule_prune
 
 
 random_bp = Blueprint('random', __name__)
@@ -29,14 +30,13 @@ def update_profile_picture(user_id):
         if file.filename == "" or not allowed_file(file.filename):
             return jsonify({"message": "Invalid image file"}), 400
 
-        # Read file data and type
-        image_data = file.read()
-        mime_type = file.mimetype
+        # Store the picture in the image store and point the user at it
+        old_hash = user.profile_picture_hash
+        user.profile_picture_hash = store_image(file.read(), file.mimetype)
+        if old_hash != user.profile_picture_hash:
+            # the old picture is removed by a job once nothing references it
+            schedule_prune([old_hash])
 
-        # Update user record
-        user.profile_picture_data = image_data
-        user.profile_picture_type = mime_type
-        
         db.session.commit()
 
         return jsonify({
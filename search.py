@@ -0,0 +1,188 @@
+import re
+from sqlalchemy import event, text, DDL, or_, bindparam
+from extensions import db
+from models import Landmark, Comment
+
+# sqlite keeps landmark names, descriptions and comment texts in one fts5 table, other
+# databases fall back to LIKE over the tables themselves
+SEARCH_TABLE = "search_index"
+
+# names weigh ten times the description or a comment, the last column is landmark_id
+RANK = "bm25(10.0, 1.0, 0.0)"
+
+MAX_QUERY_TERMS = 10
+SNIPPET_TOKENS = 12
+
+# rowids per DELETE when many documents go at once, well below sqlite's bound parameter limit
+UNINDEX_BATCH = 500
+
+create_search_index = [
+    DDL(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"title, body, landmark_id UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ).execute_if(dialect="sqlite"),
+    DDL(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', '{RANK}')").execute_if(dialect="sqlite"),
+]
+
+
+def uses_fts(connection):
+    return connection.dialect.name == "sqlite"
+
+
+# landmarks and comments share the index, even rowids are landmarks and odd ones comments
+def landmark_rowid(landmark_id):
+    return landmark_id * 2
+
+def comment_rowid(comment_id):
+    return comment_id * 2 + 1
+
+
+
+########################################################################## words of a user query, ready for MATCH (every word must match, with prefix the last one may be unfinished)
+def parse_query(q, prefix=False):
+    terms = re.findall(r"\w+", q or "")[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        # fts5 merges the doclists of every token the prefix covers, which is slower than a plain word
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+
+########################################################################## one page of hits, best first, and whether more follow it
+def search(q, limit, offset, prefix=False, connection=None):
+    connection = connection or db.session.connection()
+    if not uses_fts(connection):
+        return search_like(q, limit, offset)
+
+    match = parse_query(q, prefix)
+    if match is None:
+        return [], False
+
+    # ranked on the index alone, every match is ranked so pages never overlap or skip hits, one extra
+    # hit tells whether there is a next page. The page is then joined to its rows: a document whose row
+    # is already gone (deleted by someone who skipped unindex_documents) still counts for the paging
+    # but is not sent
+    rows = connection.execute(text(
+        f"SELECT hit.rowid AS rowid, landmark.id AS landmark_id, landmark.name AS name, hit.snippet AS snippet, "
+        f"hit.rank AS rank, hit.rowid % 2 = 0 OR comment.id IS NOT NULL AS present "
+        f"FROM (SELECT rowid, landmark_id, rank, "
+        f"snippet({SEARCH_TABLE}, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match "
+        f"ORDER BY rank LIMIT :limit OFFSET :offset) AS hit "
+        f"LEFT JOIN landmark ON landmark.id = hit.landmark_id "
+        f"LEFT JOIN comment ON hit.rowid % 2 = 1 AND comment.id = hit.rowid / 2 "
+        f"ORDER BY hit.rank"
+    ), {"match": match, "limit": limit + 1, "offset": offset}).all()
+    has_more = len(rows) > limit
+    rows = [row for row in rows[:limit] if row.present and row.landmark_id is not None]
+
+    return [{
+        "type": "comment" if row.rowid % 2 else "landmark",
+        "landmark_id": row.landmark_id,
+        "comment_id": row.rowid // 2 if row.rowid % 2 else None,
+        "name": row.name,
+        "snippet": row.snippet,
+        # bm25 is negative, bigger is better for clients
+        "score": -row.rank,
+    } for row in rows], has_more
+
+
+def search_like(q, limit, offset):
+    terms = re.findall(r"\w+", q or "")[:MAX_QUERY_TERMS]
+    if not terms:
+        return [], False
+
+    landmarks = db.session.query(Landmark.id, Landmark.name, Landmark.description).filter(*[
+        or_(Landmark.name.ilike(f"%{term}%"), Landmark.description.ilike(f"%{term}%")) for term in terms
+    ]).order_by(Landmark.id).limit(limit + offset + 1).all()
+    comments = db.session.query(Comment.id, Comment.text, Landmark.id, Landmark.name).join(Landmark).filter(*[
+        Comment.text.ilike(f"%{term}%") for term in terms
+    ]).order_by(Comment.id).limit(limit + offset + 1).all()
+
+    # without an index there is no relevance, landmarks come before comments
+    hits = [{"type": "landmark", "landmark_id": row[0], "comment_id": None, "name": row[1], "snippet": row[2], "score": None}
+            for row in landmarks]
+    hits += [{"type": "comment", "landmark_id": row[2], "comment_id": row[0], "name": row[3], "snippet": row[1], "score": None}
+             for row in comments]
+    return hits[offset:offset + limit], len(hits) > offset + limit
+
+
+
+########################################################################## rebuilds the whole index from the landmark and comment tables
+def rebuild_search_index(connection):
+    if not uses_fts(connection):
+        return 0
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, landmark_id) "
+        f"SELECT id * 2, name, description, id FROM landmark"
+    ))
+    connection.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, landmark_id) "
+        f"SELECT id * 2 + 1, '', text, landmark_id FROM comment"
+    ))
+    return connection.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+
+
+
+########################################################################## keeps the index in sync with landmarks and comments
+def index_document(connection, rowid, title, body, landmark_id):
+    connection.execute(text(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, body, landmark_id) "
+        f"VALUES (:rowid, :title, :body, :landmark_id)"
+    ), {"rowid": rowid, "title": title, "body": body, "landmark_id": landmark_id})
+
+def unindex_document(connection, rowid):
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), {"rowid": rowid})
+
+
+# bulk deletes skip the mapper listeners, deletion.py removes their documents with this
+def unindex_documents(connection, landmark_ids=(), comment_ids=()):
+    if not uses_fts(connection):
+        return
+    rowids = [landmark_rowid(i) for i in landmark_ids] + [comment_rowid(i) for i in comment_ids]
+    stmt = text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :rowids").bindparams(bindparam("rowids", expanding=True))
+    for start in range(0, len(rowids), UNINDEX_BATCH):
+        connection.execute(stmt, {"rowids": rowids[start:start + UNINDEX_BATCH]})
+
+
+def index_landmark(mapper, connection, target):
+    if uses_fts(connection):
+        index_document(connection, landmark_rowid(target.id), target.name, target.description, target.id)
+
+def reindex_landmark(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes():
+        index_landmark(mapper, connection, target)
+
+# by rowid, landmark_id is UNINDEXED and a lookup by it reads the whole index. The landmark's comments
+# are gone already (foreign keys), through unindex_comment or a bulk delete calling unindex_documents
+def unindex_landmark(mapper, connection, target):
+    if uses_fts(connection):
+        unindex_document(connection, landmark_rowid(target.id))
+
+
+def index_comment(mapper, connection, target):
+    if uses_fts(connection):
+        index_document(connection, comment_rowid(target.id), "", target.text, target.landmark_id)
+
+def reindex_comment(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.text.history.has_changes() or state.attrs.landmark_id.history.has_changes():
+        index_comment(mapper, connection, target)
+
+def unindex_comment(mapper, connection, target):
+    if uses_fts(connection):
+        unindex_document(connection, comment_rowid(target.id))
+
+for ddl in create_search_index:
+    event.listen(Landmark.__table__, 'after_create', ddl)
+event.listen(Landmark, 'after_insert', index_landmark)
+event.listen(Landmark, 'after_update', reindex_landmark)
+event.listen(Landmark, 'after_delete', unindex_landmark)
+event.listen(Comment, 'after_insert', index_comment)
+event.listen(Comment, 'after_update', reindex_comment)
+event.listen(Comment, 'after_delete', unindex_comment)
@@ -0,0 +1,106 @@
+from operator import itemgetter
+from flask import url_for
+from sqlalchemy import select
+from extensions import db
+from models import User, Landmark, Comment, ImageVariant, LANDMARK_FIELD_COLUMNS
+
+# Column driven counterparts of the models' to_json for list endpoints. Each builder returns
+# the Core select to run and a function turning its rows (plain tuples, no ORM objects) into
+# exactly the dicts to_json would produce.
+
+
+########################################################################## image_url without a url_for call per image
+def image_url_builder():
+    prefix = url_for("images.get_image", image_hash="0", _external=True)[:-1]
+    return lambda image_hash: prefix + image_hash if image_hash else None
+
+
+def variants_of(source_hashes, session):
+    variants = {}
+    if source_hashes:
+        rows = session.execute(
+            select(ImageVariant.source_hash, ImageVariant.variant, ImageVariant.image_hash)
+            .where(ImageVariant.source_hash.in_(source_hashes))
+        )
+        for source_hash, variant, image_hash in rows:
+            variants.setdefault(source_hash, {})[variant] = image_hash
+    return variants
+
+
+
+########################################################################## landmarks, limited to the requested fields like Landmark.to_json(fields)
+def landmark_serializer(fields=None, session=None):
+    session = session or db.session
+    wanted = fields or list(LANDMARK_FIELD_COLUMNS)
+    columns = sorted({column for field in wanted for column in LANDMARK_FIELD_COLUMNS[field]} | {"id"})
+    position = {column: index for index, column in enumerate(columns)}
+
+    plain = [field for field in wanted if field not in ("image", "images")]
+    plain_values = itemgetter(*[position[LANDMARK_FIELD_COLUMNS[field][0]] for field in plain]) if plain else None
+    with_image = "image" in wanted
+    with_images = "images" in wanted
+    image_at = position.get("image_hash")
+    url = image_url_builder()
+
+    def serialize(rows):
+        variants = variants_of({row[image_at] for row in rows}, session) if with_image or with_images else {}
+        result = []
+        for row in rows:
+            if plain_values is None:
+                item = {}
+            elif len(plain) == 1:
+                item = {plain[0]: plain_values(row)}
+            else:
+                item = dict(zip(plain, plain_values(row)))
+
+            if with_image or with_images:
+                row_variants = variants.get(row[image_at], {})
+                if with_image:
+                    # cards are what the list view renders, the original is used until variants exist
+                    item["image"] = url(row_variants.get("card", row[image_at]))
+                if with_images:
+                    item["images"] = {name: url(image_hash) for name, image_hash in row_variants.items()}
+            result.append(item)
+        return result
+
+    return select(*[Landmark.__table__.c[column] for column in columns]), serialize
+
+
+
+########################################################################## users, like User.to_json
+def user_serializer():
+    keys = ("id", "firstName", "lastName", "username", "email", "status")
+    stmt = select(User.id, User.first_name, User.last_name, User.username, User.email, User.status, User.profile_picture_hash)
+    url = image_url_builder()
+
+    def serialize(rows):
+        result = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            item["profile_picture"] = url(row[6])
+            result.append(item)
+        return result
+
+    return stmt, serialize
+
+
+
+########################################################################## comments with their author, like Comment.to_json
+def comment_serializer():
+    keys = ("id", "text", "likes", "dislikes", "date_of_creation", "landmark_id", "user_id", "username")
+    stmt = select(
+        Comment.id, Comment.text, Comment.likes, Comment.dislikes, Comment.date_of_creation,
+        Comment.landmark_id, Comment.user_id, User.username, User.profile_picture_hash
+    ).join(User, User.id == Comment.user_id)
+    url = image_url_builder()
+
+    def serialize(rows):
+        result = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            item["date_of_creation"] = row[4].isoformat()
+            item["profile_picture"] = url(row[8])
+            result.append(item)
+        return result
+
+    return stmt, serialize
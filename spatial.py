@@ -0,0 +1,150 @@
+import math
+from sqlalchemy import event, text, DDL, bindparam
+from extensions import db
+from models import Landmark
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+# sqlite keeps landmark coordinates in an r-tree, other databases fall back to ix_landmark_lat_lon
+RTREE_TABLE = "landmark_rtree"
+
+# nearest first queries fetch this many times the page from the database before ranking by real distance
+NEAREST_OVERFETCH = 4
+
+create_rtree = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+).execute_if(dialect="sqlite")
+
+
+def uses_rtree(connection):
+    return connection.dialect.name == "sqlite"
+
+
+
+########################################################################## great-circle distance in meters
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+
+########################################################################## smallest bounding box (min_lat, min_lon, max_lat, max_lon) around a circle
+def bbox_around(lat, lon, radius):
+    lat_delta = radius / METERS_PER_DEGREE_LAT
+    min_lat, max_lat = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+
+    cos_lat = math.cos(math.radians(lat))
+    if min_lat <= -90.0 or max_lat >= 90.0 or cos_lat < 1e-9:
+        return min_lat, -180.0, max_lat, 180.0
+
+    lon_delta = radius / (METERS_PER_DEGREE_LAT * cos_lat)
+    if lon_delta >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+
+    min_lon, max_lon = lon - lon_delta, lon + lon_delta
+    # boxes crossing the antimeridian are returned with min_lon > max_lon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, min_lon, max_lat, max_lon
+
+
+
+########################################################################## (id, latitude, longitude) of landmarks inside a bounding box, with near=(lat, lon) roughly closest first
+# the database sorts by a flat-earth distance and keeps only the first `limit` rows, the caller re-ranks them exactly
+def landmarks_in_bbox(min_lat, min_lon, max_lat, max_lon, near=None, limit=None):
+    if min_lon > max_lon:
+        return (landmarks_in_bbox(min_lat, min_lon, max_lat, 180.0, near, limit) +
+                landmarks_in_bbox(min_lat, -180.0, max_lat, max_lon, near, limit))
+
+    params = {"min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon, "limit": limit}
+    order = None
+    if near is not None:
+        lat, lon = near
+        # measured the short way around, a box on the other side of the antimeridian sees the point shifted by 360
+        middle = (min_lon + max_lon) / 2
+        lon = min((lon - 360.0, lon, lon + 360.0), key=lambda shifted: abs(shifted - middle))
+        params.update(near_lat=lat, near_lon=lon, cos_lat=math.cos(math.radians(lat)))
+        order = (
+            "(landmark.latitude - :near_lat) * (landmark.latitude - :near_lat) + "
+            "(landmark.longitude - :near_lon) * (landmark.longitude - :near_lon) * :cos_lat * :cos_lat"
+        )
+
+    connection = db.session.connection()
+    if uses_rtree(connection):
+        # the r-tree stores 32 bit floats rounded outwards, so the exact coordinates are re-checked,
+        # unary + keeps the planner from answering that check with ix_landmark_lat_lon instead of the r-tree
+        sql = (
+            f"SELECT landmark.id, landmark.latitude, landmark.longitude "
+            f"FROM {RTREE_TABLE} JOIN landmark ON landmark.id = {RTREE_TABLE}.id "
+            f"WHERE {RTREE_TABLE}.max_lat >= :min_lat AND {RTREE_TABLE}.min_lat <= :max_lat "
+            f"AND {RTREE_TABLE}.max_lon >= :min_lon AND {RTREE_TABLE}.min_lon <= :max_lon "
+            f"AND +landmark.latitude BETWEEN :min_lat AND :max_lat AND +landmark.longitude BETWEEN :min_lon AND :max_lon"
+        )
+    else:
+        sql = (
+            "SELECT landmark.id, landmark.latitude, landmark.longitude FROM landmark "
+            "WHERE landmark.latitude BETWEEN :min_lat AND :max_lat AND landmark.longitude BETWEEN :min_lon AND :max_lon"
+        )
+    if order is not None:
+        sql += f" ORDER BY {order}"
+    if limit is not None:
+        sql += " LIMIT :limit"
+    return connection.execute(text(sql), params).all()
+
+
+
+########################################################################## [(id, distance)] inside a bounding box, closest to (lat, lon) first, at most limit of them
+def nearest_in_bbox(min_lat, min_lon, max_lat, max_lon, lat, lon, limit=None):
+    # the flat-earth order drifts from the real one far from the center, a few spare rows cover that
+    candidates = None if limit is None else limit * NEAREST_OVERFETCH
+    rows = landmarks_in_bbox(min_lat, min_lon, max_lat, max_lon, (lat, lon), candidates)
+    return sorted(
+        ((row.id, haversine(lat, lon, row.latitude, row.longitude)) for row in rows),
+        key=lambda item: item[1]
+    )[:limit]
+
+
+
+########################################################################## [(id, distance)] within radius meters of (lat, lon), closest first, at most limit of them
+def nearest_within(lat, lon, radius, limit=None):
+    candidates = nearest_in_bbox(*bbox_around(lat, lon, radius), lat, lon, limit)
+    return [(landmark_id, distance) for landmark_id, distance in candidates if distance <= radius]
+
+
+
+########################################################################## keeps the r-tree in sync with landmark coordinates
+def index_landmark(mapper, connection, target):
+    if not uses_rtree(connection):
+        return
+    connection.execute(text(
+        f"INSERT OR REPLACE INTO {RTREE_TABLE} (id, min_lat, max_lat, min_lon, max_lon) "
+        f"VALUES (:id, :lat, :lat, :lon, :lon)"
+    ), {"id": target.id, "lat": float(target.latitude), "lon": float(target.longitude)})
+
+def reindex_landmark(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes():
+        index_landmark(mapper, connection, target)
+
+def unindex_landmark(mapper, connection, target):
+    if not uses_rtree(connection):
+        return
+    connection.execute(text(f"DELETE FROM {RTREE_TABLE} WHERE id = :id"), {"id": target.id})
+
+# bulk deletes skip the mapper listeners, deletion.py removes their entries with this
+def unindex_landmarks(connection, landmark_ids):
+    if not uses_rtree(connection) or not landmark_ids:
+        return
+    connection.execute(
+        text(f"DELETE FROM {RTREE_TABLE} WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": list(landmark_ids)}
+    )
+
+event.listen(Landmark.__table__, 'after_create', create_rtree)
+event.listen(Landmark, 'after_insert', index_landmark)
+event.listen(Landmark, 'after_update', reindex_landmark)
+event.listen(Landmark, 'after_delete', unindex_landmark)
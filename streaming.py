@@ -0,0 +1,65 @@
+from flask import request, current_app, stream_with_context
+from extensions import db
+from metrics import timed_serialization
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+########################################################################## "json", "ndjson" or None, from ?stream= or an Accept: application/x-ndjson header
+def stream_format():
+    requested = request.args.get("stream")
+    if requested in ("json", "ndjson"):
+        return requested
+    if requested is None and request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return "ndjson"
+    return None
+
+
+
+########################################################################## serialized rows, one list per chunk read from a server side cursor
+def stream_rows(stmt, serialize):
+    chunk_size = current_app.config["STREAM_CHUNK_SIZE"]
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        yield serialize(rows)
+
+
+
+########################################################################## {"<key>": [...], **trailer()} written one chunk at a time
+def json_array_response(key, chunks, trailer=None):
+    dumpb = current_app.json.dumpb
+
+    def generate():
+        yield b'{"' + key.encode() + b'":['
+        first = True
+        for items in chunks:
+            if not items:
+                continue
+            with timed_serialization():
+                chunk = (b"" if first else b",") + b",".join(map(dumpb, items))
+            yield chunk
+            first = False
+        yield b"]"
+        # fields only known once every row went by, like the interactions of the streamed landmarks
+        for name, value in (trailer() if trailer else {}).items():
+            with timed_serialization():
+                chunk = b',"' + name.encode() + b'":' + dumpb(value)
+            yield chunk
+        yield b"}"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=current_app.json.mimetype)
+
+
+
+########################################################################## one json document per line
+def ndjson_response(chunks):
+    dumpb = current_app.json.dumpb
+
+    def generate():
+        for items in chunks:
+            if items:
+                with timed_serialization():
+                    chunk = b"\n".join(map(dumpb, items)) + b"\n"
+                yield chunk
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import tempfile
+import pytest
+
+# config.py builds the app on import, so the test settings have to be in the environment first
+_scratch = tempfile.mkdtemp(prefix="landmarks-tests-")
+PRIMARY_PATH = os.path.join(_scratch, "primary.db")
+REPLICA_PATH = os.path.join(_scratch, "replica.db")
+
+os.environ.update({
+    "SECRET_KEY": "test-secret-key-that-is-long-enough-for-hs256",
+    "DATABASE_URL": f"sqlite:///{PRIMARY_PATH}",
+    "DATABASE_REPLICA_URLS": f"sqlite:///{REPLICA_PATH}",
+    "DB_PROFILE": "test",
+    "JOB_WORKERS": "0",
+    "PASSWORD_HASH_WORKERS": "0",
+    # the cheapest scrypt cost, logins in every test would take seconds at the real one
+    "PASSWORD_SCRYPT_N": "16",
+    # counters are flushed by the tests themselves
+    "COUNTER_FLUSH_INTERVAL": "3600",
+    "COUNTER_RECONCILE_INTERVAL": "0",
+    "RESPONSE_CACHE_WARM_PATHS": "",
+})
+
+from config import app as flask_app, db
+from passwords import hash_password_sync
+from models import User, Image, Landmark, Comment
+import counters
+import decorators
+import responsecache
+
+
+########################################################################## copies the primary file over the replica, what replication would do
+def replicate():
+    with flask_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    source = sqlite3.connect(PRIMARY_PATH)
+    target = sqlite3.connect(REPLICA_PATH)
+    source.backup(target)
+    target.close()
+    source.close()
+
+
+
+########################################################################## a fresh primary and replica for every test
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    for path in (PRIMARY_PATH, REPLICA_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+    with flask_app.app_context():
+        db.create_all()
+    replicate()
+
+    responsecache.clear()
+    decorators._status_cache.clear()
+    decorators._claims_cache.clear()
+    with counters._lock:
+        counters._pending.clear()
+        counters._generations.clear()
+
+    yield flask_app
+
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, email, password="pw"):
+    response = client.post("/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+
+########################################################################## users, landmarks and comments straight through the models
+# every test user's password is "pw"
+PASSWORD_HASH = hash_password_sync("pw", 16, 8, 1)
+
+
+def add_user(username, status="user"):
+    user = User(username=username, password=PASSWORD_HASH, email=f"{username}@example.com", status=status)
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def add_image(seed):
+    image_hash = f"{seed:064x}"
+    if db.session.get(Image, image_hash) is None:
+        db.session.add(Image(hash=image_hash, data=b"\x89PNG", mime_type="image/png", size=4))
+    return image_hash
+
+
+def add_landmark(user, name="Landmark", latitude=48.1, longitude=17.1, image_seed=1):
+    landmark = Landmark(
+        name=name, description=f"{name} description", image_hash=add_image(image_seed),
+        latitude=latitude, longitude=longitude, user_id=user.id
+    )
+    db.session.add(landmark)
+    db.session.flush()
+    return landmark
+
+
+def add_comment(landmark, user, text="Nice place"):
+    comment = Comment(text=text, landmark_id=landmark.id, user_id=user.id)
+    db.session.add(comment)
+    db.session.flush()
+    return comment
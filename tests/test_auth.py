@@ -0,0 +1,73 @@
+from sqlalchemy import update
+import passwords
+from extensions import db
+from models import User, bump_resource_versions
+from passwords import hash_password_sync
+from conftest import add_user
+
+
+def log_in(client, email, password="pw"):
+    return client.post("/login", json={"email": email, "password": password})
+
+
+def count_verifications(monkeypatch):
+    calls = []
+    verify = passwords.verify_password_sync
+
+    def counting(password, stored):
+        calls.append(stored)
+        return verify(password, stored)
+
+    monkeypatch.setattr(passwords, "verify_password_sync", counting)
+    return calls
+
+
+
+########################################################################## passwords are only ever compared against scrypt hashes
+def test_plain_stored_password_is_rejected(app, client):
+    with app.app_context():
+        add_user("legacy").password = "pw"
+        db.session.commit()
+
+    assert log_in(client, "legacy@example.com").status_code == 401
+
+
+def test_unknown_email_costs_a_hash_check(app, client, monkeypatch):
+    with app.app_context():
+        add_user("known")
+        db.session.commit()
+    calls = count_verifications(monkeypatch)
+
+    assert log_in(client, "nobody@example.com").status_code == 401
+    assert log_in(client, "known@example.com", "wrong").status_code == 401
+
+    assert len(calls) == 2
+    assert all(stored.startswith("scrypt$16$") for stored in calls)
+
+
+def test_login_rehashes_an_older_cost(app, client):
+    with app.app_context():
+        add_user("old").password = hash_password_sync("pw", 32, 8, 1)
+        db.session.commit()
+
+    assert log_in(client, "old@example.com").status_code == 200
+
+    with app.app_context():
+        assert User.query.filter_by(username="old").one().password.startswith("scrypt$16$8$1$")
+
+
+
+########################################################################## a demotion committed by another worker reaches this worker's status cache
+def test_status_cache_follows_other_workers(app, client):
+    with app.app_context():
+        admin_id = add_user("boss", status="admin").id
+        db.session.commit()
+    log_in(client, "boss@example.com")
+    assert client.get("/jobs").status_code == 200
+
+    # plain Core statements, like another process: none of this process' listeners see them
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(update(User).where(User.id == admin_id).values(status="user"))
+        bump_resource_versions(connection, {"users"})
+
+    assert client.get("/jobs").status_code == 403
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import select
+from extensions import db
+from models import Landmark, LandmarkCluster
+from clustering import MAX_CLUSTER_ZOOM, MAX_MERCATOR_LAT, cell_for, cell_bounds
+from deletion import delete_landmarks
+from conftest import add_user, add_landmark
+
+
+def representatives():
+    return db.session.execute(select(LandmarkCluster.zoom, LandmarkCluster.representative_id)).all()
+
+
+
+########################################################################## cell_bounds covers exactly what cell_for puts in the cell, clamped edge rows included
+@pytest.mark.parametrize("lat, lon", [(89.9, 10.0), (-89.9, -170.0), (MAX_MERCATOR_LAT, 0.0), (48.1, 17.1), (0.0, 180.0)])
+def test_cell_bounds_contain_the_coordinates_of_the_cell(lat, lon):
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        min_lat, min_lon, max_lat, max_lon = cell_bounds(*cell_for(lat, lon, zoom), zoom)
+        assert min_lat <= lat <= max_lat
+        assert min_lon <= lon <= max_lon
+
+
+
+########################################################################## a removed representative near a pole is replaced by the landmark still in its cell
+@pytest.mark.parametrize("bulk", [False, True])
+def test_polar_cells_find_a_stand_in(app, bulk):
+    with app.app_context():
+        user = add_user("explorer")
+        first = add_landmark(user, name="North Pole", latitude=89.9, longitude=10.0)
+        second = add_landmark(user, name="Polar Camp", latitude=89.8, longitude=10.0)
+        db.session.commit()
+        first_id, second_id = first.id, second.id
+        assert {representative for _, representative in representatives()} == {first_id}
+
+        if bulk:
+            delete_landmarks([first_id])
+        else:
+            db.session.delete(db.session.get(Landmark, first_id))
+        db.session.commit()
+
+        assert sorted(representatives()) == [(zoom, second_id) for zoom in range(MAX_CLUSTER_ZOOM + 1)]
@@ -0,0 +1,82 @@
+import pytest
+from extensions import db
+from conftest import replicate, login, add_user, add_landmark
+
+
+@pytest.fixture
+def landmark_id(app):
+    with app.app_context():
+        voter = add_user("voter")
+        add_user("watcher")
+        landmark_id = add_landmark(voter, name="Bridge").id
+        db.session.commit()
+    replicate()
+    return landmark_id
+
+
+def revalidate(client, path, etag):
+    return client.get(path, headers={"If-None-Match": etag})
+
+
+
+########################################################################## a vote changes the voter's etags at once, nobody else's until the counters flush
+@pytest.mark.parametrize("path", ["/landmarks", "/landmarks/top", "/landmarks/within?bbox=17,48,18,49"])
+def test_vote_changes_the_voters_etag(app, client, landmark_id, path):
+    login(client, "voter@example.com")
+    etag = client.get(path).headers["ETag"].strip('"')
+    assert revalidate(client, path, etag).status_code == 304
+
+    assert client.post("/reaction", json={"landmark_id": landmark_id, "reaction": "like"}).status_code in (200, 201)
+
+    response = revalidate(client, path, etag)
+    assert response.status_code == 200
+    assert response.get_json()["interactions"] == {str(landmark_id): "like"}
+
+
+def test_vote_keeps_other_users_etag(app, client, landmark_id):
+    watcher = app.test_client()
+    login(watcher, "watcher@example.com")
+    etag = watcher.get("/landmarks").headers["ETag"].strip('"')
+
+    login(client, "voter@example.com")
+    client.post("/reaction", json={"landmark_id": landmark_id, "reaction": "like"})
+
+    assert revalidate(watcher, "/landmarks", etag).status_code == 304
+
+
+def test_interacted_follows_the_vote(app, client, landmark_id):
+    login(client, "voter@example.com")
+    response = client.get("/interacted", json={"landmark_id": landmark_id})
+    assert response.get_json()["user_reaction"] is None
+    etag = response.headers["ETag"].strip('"')
+
+    client.post("/reaction", json={"landmark_id": landmark_id, "reaction": "dislike"})
+
+    response = client.open("/interacted", method="GET", json={"landmark_id": landmark_id}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["user_reaction"] == "dislike"
+
+
+
+########################################################################## json and ndjson answers of one url never share a validator
+def test_accept_is_part_of_the_etag(app, client, landmark_id):
+    response = client.get("/landmarks", headers={"Accept": "application/json"})
+    assert "Accept" in response.headers["Vary"]
+    etag = response.headers["ETag"].strip('"')
+
+    response = client.get("/landmarks", headers={"Accept": "application/x-ndjson", "If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    response = client.get("/landmarks", headers={"Accept": "application/json", "If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+
+
+########################################################################## cached bodies carry absolute image urls, every host gets its own
+def test_response_cache_is_per_host(app, client, landmark_id):
+    public = client.get("/landmarks", base_url="https://maps.example.com").get_json()
+    internal = client.get("/landmarks", base_url="http://internal:8000").get_json()
+
+    assert public["landmarks"][0]["image"].startswith("https://maps.example.com/")
+    assert internal["landmarks"][0]["image"].startswith("http://internal:8000/")
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Landmark
+from database import PROFILES, engine_options, pragma_listener, run_load_test
+from conftest import add_image
+
+# what sqlite reports back for the values the profiles set
+REPORTED = {
+    "journal_mode": lambda value: value.lower(),
+    "synchronous": {"OFF": 0, "NORMAL": 1, "FULL": 2}.get,
+    "temp_store": {"DEFAULT": 0, "FILE": 1, "MEMORY": 2}.get,
+    "foreign_keys": {"OFF": 0, "ON": 1}.get,
+}
+
+
+def reported_pragmas(connection, pragmas):
+    return {name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in pragmas}
+
+
+def expected_pragmas(pragmas):
+    return {name: REPORTED.get(name, int)(value) for name, value in pragmas.items()}
+
+
+def profile_engine(profile):
+    uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'profile.db')}"
+    engine = create_engine(uri, **engine_options(uri, profile))
+    event.listen(engine, "connect", pragma_listener(profile["pragmas"]))
+    return engine
+
+
+
+########################################################################## every new connection carries its profile's pragmas
+@pytest.mark.parametrize("name", list(PROFILES))
+def test_profile_pragmas_are_applied(name):
+    pragmas = PROFILES[name]["pragmas"]
+    engine = profile_engine(PROFILES[name])
+    try:
+        # two connections at once, the pool opens a second one
+        with engine.connect() as first, engine.connect() as second:
+            assert reported_pragmas(first, pragmas) == expected_pragmas(pragmas)
+            assert reported_pragmas(second, pragmas) == expected_pragmas(pragmas)
+    finally:
+        engine.dispose()
+
+
+def test_app_engines_use_the_test_profile(app):
+    pragmas = PROFILES["test"]["pragmas"]
+    with app.app_context():
+        for engine in db.engines.values():
+            with engine.connect() as connection:
+                assert reported_pragmas(connection, pragmas) == expected_pragmas(pragmas)
+
+
+
+########################################################################## foreign_keys=ON makes sqlite reject rows pointing nowhere
+def test_foreign_keys_reject_missing_parents(app):
+    with app.app_context():
+        db.session.add(Landmark(name="Orphan", description="", latitude=0, longitude=0, user_id=12345, image_hash=add_image(1)))
+        with pytest.raises(IntegrityError, match="FOREIGN KEY"):
+            db.session.commit()
+        db.session.rollback()
+        assert db.session.query(Landmark).count() == 0
+
+
+
+########################################################################## the production profile keeps readers and a writer from locking each other out
+def test_load_test_with_production_pragmas():
+    result = run_load_test(PROFILES["production"]["pragmas"], readers=4, writers=1, seconds=1.0)
+    assert result["reads"] > 0
+    assert result["writes"] > 0
+    assert result["locked"] == 0
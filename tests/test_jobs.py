@@ -0,0 +1,73 @@
+from sqlalchemy import select
+from extensions import db
+from models import Job
+import jobs
+from conftest import login, add_user
+
+
+def keyed(key="rebuild", status='queued'):
+    return db.session.execute(select(Job).where(Job.key == key, Job.status == status)).scalars().all()
+
+
+@jobs.handler("test_fails")
+def failing_job(payload):
+    raise RuntimeError("always fails")
+
+
+
+########################################################################## uq_job_queued_key: one queued job per key, one may wait behind a running one
+def test_enqueue_returns_the_queued_job_for_a_key(app):
+    with app.app_context():
+        first = jobs.enqueue("rebuild", key="rebuild")
+        db.session.commit()
+        assert jobs.enqueue("rebuild", key="rebuild").id == first.id
+        db.session.commit()
+
+        assert len(keyed()) == 1
+
+
+def test_a_running_job_gets_one_queued_behind_it(app):
+    with app.app_context():
+        running = jobs.enqueue("rebuild", key="rebuild")
+        db.session.commit()
+        assert jobs.claim_job("worker", running.id) == running.id
+
+        behind = jobs.enqueue("rebuild", key="rebuild")
+        db.session.commit()
+        assert behind.id != running.id
+        assert jobs.enqueue("rebuild", key="rebuild").id == behind.id
+        db.session.commit()
+        assert jobs.enqueue_detached("rebuild", key="rebuild") == behind.id
+
+
+def test_failed_retry_gives_way_to_a_queued_job(app):
+    with app.app_context():
+        running = jobs.enqueue("test_fails", key="rebuild")
+        db.session.commit()
+        jobs.claim_job("worker", running.id)
+        behind = jobs.enqueue("test_fails", key="rebuild")
+        db.session.commit()
+        running_id, behind_id = running.id, behind.id
+
+        assert jobs.run_claimed_job(running_id, "worker") is False
+
+        assert db.session.get(Job, running_id).status == 'failed'
+        assert [job.id for job in keyed()] == [behind_id]
+
+
+def test_retry_returns_the_job_already_queued(app, client):
+    with app.app_context():
+        add_user("admin", status="admin")
+        failed = Job(kind="rebuild", key="rebuild", status='failed')
+        queued = Job(kind="rebuild", key="rebuild", status='queued')
+        db.session.add_all([failed, queued])
+        db.session.commit()
+        failed_id, queued_id = failed.id, queued.id
+    login(client, "admin@example.com")
+
+    response = client.post(f"/jobs/{failed_id}/retry")
+
+    assert response.status_code == 202
+    assert response.get_json()["id"] == queued_id
+    with app.app_context():
+        assert db.session.get(Job, failed_id).status == 'failed'
@@ -0,0 +1,48 @@
+import io
+from PIL import Image as PILImage
+from extensions import db
+from models import Landmark, LandmarkScore
+from ranking import wilson_score
+from conftest import add_user
+
+
+def png():
+    buffer = io.BytesIO()
+    PILImage.new("RGB", (8, 8), "red").save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def new_landmark(client, user_id, **fields):
+    form = {
+        "name": "Castle", "description": "On a hill", "latitude": "48.1", "longitude": "17.1",
+        "user_id": str(user_id), "image": (png(), "castle.png"), **fields
+    }
+    return client.post("/newlandmark", data=form, content_type="multipart/form-data")
+
+
+
+########################################################################## POST /newlandmark, likes arrive as a form string
+def test_create_landmark_with_likes(app, client):
+    with app.app_context():
+        user_id = add_user("builder").id
+        db.session.commit()
+
+    response = new_landmark(client, user_id, likes="3")
+
+    assert response.status_code == 201, response.get_json()
+    with app.app_context():
+        landmark = db.session.get(Landmark, response.get_json()["id"])
+        assert landmark.likes == 3
+        assert db.session.get(LandmarkScore, landmark.id).top == wilson_score(3, 0)
+
+
+def test_create_landmark_ignores_unparsable_likes(app, client):
+    with app.app_context():
+        user_id = add_user("builder").id
+        db.session.commit()
+
+    response = new_landmark(client, user_id, likes="many")
+
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()["likes"] == 0
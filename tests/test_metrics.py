@@ -0,0 +1,125 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import metrics
+from extensions import db
+from conftest import replicate, add_user, add_landmark
+
+
+@pytest.fixture
+def fresh_metrics(app):
+    with metrics._lock:
+        for series in metrics._values.values():
+            series.clear()
+    yield metrics._values
+    app.config["METRICS_TOKEN"] = None
+
+
+def series(name, *labels):
+    return metrics._values[name].get(labels)
+
+
+
+########################################################################## a value lands in the first bucket it fits, rendered buckets and the count add up
+def test_render_cumulates_buckets(fresh_metrics):
+    endpoint = ("landmarks.get_landmarks",)
+    for value in (0, 1, 1, 3, 7, 1000):
+        metrics._observe("http_request_db_queries", endpoint, value)
+
+    # buckets 0, 1, 2, 5, 10, ... and +Inf, the bounds are inclusive
+    assert series("http_request_db_queries", *endpoint)[:5] == [1, 2, 0, 1, 1]
+    assert series("http_request_db_queries", *endpoint)[-2:] == [1, 1012]
+
+    lines = metrics.render(fresh_metrics).splitlines()
+    label = 'endpoint="landmarks.get_landmarks"'
+    assert f'http_request_db_queries_bucket{{{label},le="0"}} 1' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="1"}} 3' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="2"}} 3' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="5"}} 4' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="10"}} 5' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="500"}} 5' in lines
+    assert f'http_request_db_queries_bucket{{{label},le="+Inf"}} 6' in lines
+    assert f"http_request_db_queries_sum{{{label}}} 1012.0" in lines
+    assert f"http_request_db_queries_count{{{label}}} 6" in lines
+
+
+
+########################################################################## every statement a request runs is counted by the cursor listeners
+def test_counts_sql_per_request(app, client, fresh_metrics):
+    executed = []
+    with app.app_context():
+        add_landmark(add_user("writer"), name="Tower")
+        db.session.commit()
+    replicate()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        assert client.get("/landmarks").status_code == 200
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+
+    queries = series("http_request_db_queries", "landmarks.get_landmarks")
+    assert executed
+    assert sum(queries[:-1]) == 1
+    assert queries[-1] == len(executed)
+    assert sum(series("db_query_duration_seconds", "landmarks.get_landmarks")[:-1]) == len(executed)
+
+
+
+########################################################################## a streamed body is counted chunk by chunk, as it goes out
+def test_counts_streamed_bytes(app, client, fresh_metrics):
+    with app.app_context():
+        user = add_user("writer")
+        for index in range(5):
+            add_landmark(user, name=f"Tower {index}")
+        db.session.commit()
+    replicate()
+
+    response = client.get("/landmarks", query_string={"stream": "ndjson"})
+    assert response.status_code == 200
+    assert response.content_length is None
+    body = response.get_data()
+    response.close()
+
+    assert len(body.splitlines()) == 5
+    sizes = series("http_response_size_bytes", "landmarks.get_landmarks")
+    assert sizes[-1] == len(body)
+
+
+
+########################################################################## the token is checked when set, and an unset one only answers in debug or testing mode
+def test_metrics_token(app, client, fresh_metrics):
+    app.config["METRICS_TOKEN"] = "scrape-me"
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    app.config["METRICS_TOKEN"] = None
+    assert not app.testing and not app.debug
+    assert client.get("/metrics").status_code == 403
+    app.testing = True
+    try:
+        assert client.get("/metrics").status_code == 200
+    finally:
+        app.testing = False
+
+
+
+########################################################################## scrapes are not traffic, /metrics leaves no numbers of its own
+def test_metrics_endpoint_is_not_recorded(app, client, fresh_metrics):
+    app.config["METRICS_TOKEN"] = "scrape-me"
+    for _ in range(3):
+        response = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+        assert response.status_code == 200
+    assert client.get("/landmarks").status_code == 200
+
+    endpoints = {labels[0] for labels in fresh_metrics["http_requests_total"]}
+    assert endpoints == {"landmarks.get_landmarks"}
+    assert "metrics.get_metrics" not in response.get_data(as_text=True)
+    assert fresh_metrics["http_requests_total"][("landmarks.get_landmarks", "GET", "200")] == 1
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from extensions import db
+from models import User, Landmark, ImageVariant
+from conftest import replicate, login, add_user, add_image, add_landmark, add_comment
+import decorators
+import responsecache
+
+# list endpoints, each must cost the same number of statements for one landmark as for fifty
+LIST_ENDPOINTS = [
+    "/landmarks",
+    "/landmarks?fields=id,name,image,images,likes",
+    "/me/landmarks",
+    "/landmarks/top",
+    "/landmarks/trending",
+    "/landmarks/1/comments",
+    "/users",
+]
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+
+def statements_for(client, path):
+    # every measurement starts from cold caches
+    responsecache.clear()
+    decorators._status_cache.clear()
+    with count_statements() as statements:
+        response = client.get(path)
+    assert response.status_code == 200, response.get_json()
+    return statements
+
+
+
+########################################################################## landmarks of the admin, each with variants and comments by users with profile pictures
+def seed(app, count):
+    with app.app_context():
+        admin = User.query.filter_by(status="admin").first() or add_user("admin", status="admin")
+        first = db.session.get(Landmark, 1)
+
+        for index in range(Landmark.query.count(), count):
+            landmark = add_landmark(admin, name=f"Landmark {index}", latitude=40 + index * 0.01, image_seed=10 + index)
+            for number, variant in enumerate(("thumb", "card", "full")):
+                variant_hash = add_image(10000 + index * 3 + number)
+                db.session.add(ImageVariant(source_hash=landmark.image_hash, variant=variant, image_hash=variant_hash))
+            author = add_user(f"author{index}")
+            author.profile_picture_hash = add_image(20000 + index)
+            add_comment(landmark, author)
+            # the comment page of the first landmark grows as well
+            first = first or landmark
+            add_comment(first, author, text=f"Comment {index}")
+        db.session.commit()
+    replicate()
+
+
+@pytest.mark.parametrize("path", LIST_ENDPOINTS)
+def test_statement_count_does_not_grow_with_rows(app, client, path):
+    seed(app, 1)
+    login(client, "admin@example.com")
+    few = statements_for(client, path)
+
+    seed(app, 50)
+    many = statements_for(client, path)
+
+    assert len(few) == len(many), "\n".join(many)
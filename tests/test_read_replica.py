@@ -0,0 +1,86 @@
+import sqlite3
+import time
+from extensions import db
+from models import Landmark
+from database import STICKY_COOKIE
+from conftest import PRIMARY_PATH, REPLICA_PATH, replicate, login, add_user, add_landmark
+
+
+def landmark_names(client):
+    response = client.get("/landmarks")
+    assert response.status_code == 200
+    return [landmark["name"] for landmark in response.get_json()["landmarks"]]
+
+
+def rename_on_primary(app, landmark_id, name):
+    # a write the replica has not caught up with yet
+    with app.app_context():
+        db.session.get(Landmark, landmark_id).name = name
+        db.session.commit()
+
+
+def comment_texts(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute("SELECT text FROM comment")]
+    finally:
+        connection.close()
+
+
+def seed(app):
+    with app.app_context():
+        user = add_user("reader")
+        landmark_id = add_landmark(user, name="Original").id
+        db.session.commit()
+    replicate()
+    return landmark_id
+
+
+
+########################################################################## @read_replica views read the replica file, writes always go to the primary
+def test_read_replica_views_read_the_replica(app, client):
+    landmark_id = seed(app)
+    rename_on_primary(app, landmark_id, "Renamed")
+
+    assert landmark_names(client) == ["Original"]
+
+    replicate()
+    assert landmark_names(client) == ["Renamed"]
+
+
+def test_writes_go_to_the_primary(app, client):
+    landmark_id = seed(app)
+    login(client, "reader@example.com")
+
+    response = client.post("/comment", json={"landmark_id": landmark_id, "text": "Written to the primary"})
+    assert response.status_code == 201, response.get_json()
+
+    assert comment_texts(PRIMARY_PATH) == ["Written to the primary"]
+    assert comment_texts(REPLICA_PATH) == []
+
+
+
+########################################################################## read your writes: after a write the client reads the primary until its cookie expires
+def test_sticky_cookie_forces_the_primary_after_a_write(app, client):
+    landmark_id = seed(app)
+    login(client, "reader@example.com")
+    client.delete_cookie(STICKY_COOKIE)
+    rename_on_primary(app, landmark_id, "Renamed")
+    assert landmark_names(client) == ["Original"]
+
+    response = client.post("/comment", json={"landmark_id": landmark_id, "text": "A write"})
+    assert response.status_code == 201
+    sticky = client.get_cookie(STICKY_COOKIE)
+    assert sticky is not None and float(sticky.value) > time.time()
+
+    assert landmark_names(client) == ["Renamed"]
+
+    # once it expired the replica is read again
+    client.set_cookie(STICKY_COOKIE, str(time.time() - 1))
+    assert landmark_names(client) == ["Original"]
+
+
+def test_reads_without_a_write_set_no_cookie(app, client):
+    seed(app)
+    landmark_names(client)
+    assert client.get_cookie(STICKY_COOKIE) is None
@@ -0,0 +1,57 @@
+from sqlalchemy import delete, text
+from extensions import db
+from models import Landmark, Comment
+from search import SEARCH_TABLE
+from conftest import replicate, add_user, add_landmark, add_comment
+
+
+def search_page(client, cursor=None):
+    response = client.get("/search", query_string={"q": "tower", "limit": 3, **({"cursor": cursor} if cursor else {})})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def indexed_rowids():
+    return [row[0] for row in db.session.execute(text(f"SELECT rowid FROM {SEARCH_TABLE} ORDER BY rowid"))]
+
+
+
+########################################################################## documents left behind by a delete still count for paging, the pages after them are reached
+def test_orphaned_hits_do_not_end_the_results(app, client):
+    with app.app_context():
+        user = add_user("writer")
+        landmark = add_landmark(user, name="Tower")
+        comments = [add_comment(landmark, user, f"tower view {index}") for index in range(6)]
+        comment_ids = [comment.id for comment in comments]
+        orphaned = comment_ids[:4]
+        # a delete that forgot unindex_documents
+        db.session.execute(delete(Comment).where(Comment.id.in_(orphaned)))
+        db.session.commit()
+    replicate()
+
+    seen, cursor = [], None
+    while True:
+        page = search_page(client, cursor)
+        seen += [(hit["type"], hit["comment_id"]) for hit in page["results"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen, key=str) == sorted([("landmark", None)] + [("comment", comment_id) for comment_id in comment_ids[4:]], key=str)
+
+
+
+########################################################################## a landmark removed through the session leaves the index by its rowid
+def test_deleted_landmark_leaves_the_index(app):
+    with app.app_context():
+        user = add_user("writer")
+        kept = add_landmark(user, name="Kept")
+        gone = add_landmark(user, name="Gone", image_seed=2)
+        db.session.commit()
+        kept_id = kept.id
+
+        db.session.delete(gone)
+        db.session.commit()
+
+        assert indexed_rowids() == [kept_id * 2]
+        assert db.session.query(Landmark).count() == 1
@@ -0,0 +1,76 @@
+import random
+import pytest
+from sqlalchemy import event
+from extensions import db
+from spatial import RTREE_TABLE, haversine, landmarks_in_bbox, nearest_in_bbox, nearest_within
+from conftest import add_user, add_landmark
+
+
+@pytest.fixture
+def scattered(app):
+    rng = random.Random(7)
+    with app.app_context():
+        user = add_user("mapper")
+        points = {}
+        for index in range(160):
+            # a band around the antimeridian and one around central europe
+            lon = rng.uniform(170, 180) if index % 2 else rng.uniform(-180, -170)
+            lat, lon = (rng.uniform(-60, 60), lon) if index < 80 else (rng.uniform(40, 55), rng.uniform(5, 25))
+            points[add_landmark(user, name=f"Point {index}", latitude=lat, longitude=lon).id] = (lat, lon)
+        db.session.commit()
+        yield points
+
+
+def brute_force(points, lat, lon, keep):
+    return sorted(((landmark_id, haversine(lat, lon, *point)) for landmark_id, point in points.items() if keep(*point)),
+                  key=lambda item: item[1])
+
+
+
+########################################################################## only the page is fetched, and it is the true nearest page
+@pytest.mark.parametrize("box, center", [
+    ((40.0, 5.0, 55.0, 25.0), (47.5, 15.0)),
+    ((-60.0, 170.0, 60.0, -170.0), (0.0, 180.0)),
+    ((-60.0, -180.0, 60.0, 180.0), (50.0, 10.0)),
+])
+def test_nearest_in_bbox_matches_brute_force(scattered, box, center):
+    min_lat, min_lon, max_lat, max_lon = box
+
+    def inside(lat, lon):
+        in_lon = min_lon <= lon <= max_lon if min_lon <= max_lon else lon >= min_lon or lon <= max_lon
+        return min_lat <= lat <= max_lat and in_lon
+
+    expected = brute_force(scattered, *center, inside)
+    assert nearest_in_bbox(*box, *center, limit=10) == expected[:10]
+    assert nearest_in_bbox(*box, *center) == expected
+
+
+def test_nearest_within_respects_radius_and_limit(scattered):
+    expected = [match for match in brute_force(scattered, 48.0, 15.0, lambda lat, lon: True) if match[1] <= 300000]
+    assert nearest_within(48.0, 15.0, 300000, limit=5) == expected[:5]
+    assert nearest_within(48.0, 15.0, 300000) == expected
+
+
+def test_bbox_query_stops_at_the_limit(scattered):
+    assert len(landmarks_in_bbox(-90.0, -180.0, 90.0, 180.0, near=(0.0, 0.0), limit=7)) == 7
+
+
+
+########################################################################## the r-tree drives the bbox query, landmark rows are looked up by id
+def test_bbox_query_uses_the_rtree(app):
+    statements = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if RTREE_TABLE in statement and not statement.startswith("EXPLAIN"):
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", explain)
+        try:
+            landmarks_in_bbox(1.0, 1.0, 2.0, 2.0, near=(1.5, 1.5), limit=5)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", explain)
+        (statement, parameters), = statements
+        plan = " ".join(row[-1] for row in db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+        assert "SCAN landmark_rtree VIRTUAL TABLE INDEX 2:" in plan, plan
+        assert "SEARCH landmark USING INTEGER PRIMARY KEY" in plan, plan
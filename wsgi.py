@@ -1,4 +1,52 @@
-from config import app
+import os
+import sys
+from sqlalchemy import inspect, text
+from config import app, db
+import counters
+import jobs
+import metrics
+
+
+########################################################################## checks run once in the gunicorn master before workers are forked
+def self_check(app):
+    if not app.config.get("SECRET_KEY"):
+        raise RuntimeError("SECRET_KEY is not set")
+
+    with app.app_context():
+        db.session.execute(text("SELECT 1"))
+
+        existing = set(inspect(db.engine).get_table_names())
+        missing = sorted(set(db.metadata.tables) - existing)
+        if missing:
+            raise RuntimeError(f"Database is missing tables {', '.join(missing)}, run flask db upgrade")
+
+        db.session.remove()
+        yield f"database {db.engine.url.render_as_string(hide_password=True)} reachable, {len(existing)} tables"
+
+        for key, engine in db.engines.items():
+            if key is not None:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                yield f"bind {key} {engine.url.render_as_string(hide_password=True)} reachable"
+
+    yield f"{len(list(app.url_map.iter_rules()))} routes registered"
+
+
+
+########################################################################## runs in every worker right after the fork
+def after_fork(app):
+    with app.app_context():
+        # pooled connections opened by the master must never be shared with a worker
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    counters.reset_after_fork()
+    jobs.reset_after_fork()
+    metrics.reset_after_fork()
+
+
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    from gunicorn.app.wsgiapp import run
+
+    sys.argv = ["gunicorn", "-c", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py"), "wsgi:app"]
+    run()